@@ -1,6 +1,15 @@
+import os
+import functools
+from typing import get_type_hints
+from typing_extensions import is_typeddict
 from langgraph.graph import StateGraph, START, END
+from langgraph.types import Send
 from src.types import WorkflowState
 from src.nodes.entrada_prompt import entrada_prompt_node
+from src.nodes.descomponer import descomponer_node
+from src.nodes.subpieza import subpieza_node
+from src.nodes.ensamblar import ensamblar_node
+from src.nodes.plantilla import plantilla_node
 from src.nodes.generar_pieza import generar_pieza_node
 from src.nodes.questions import questions_node
 from src.nodes.extraer_codigo import extraer_codigo_node
@@ -12,34 +21,115 @@ from src.nodes.feedforward import feedforward_node
 from src.nodes.cleanup import cleanup_node
 from src.nodes.reparador import reparador_node
 
+
+def validar_salida(nodo):
+    """
+    Envuelve un nodo para que solo pueda escribir las claves del subestado declarado
+    como tipo de retorno, manteniendo el estado compacto.
+    """
+    salida = get_type_hints(nodo).get("return")
+    if not is_typeddict(salida):
+        return nodo
+    claves = set(get_type_hints(salida, include_extras=True))
+
+    @functools.wraps(nodo)
+    def nodo_validado(state):
+        out = nodo(state) or {}
+        extra = set(out) - claves
+        if extra:
+            raise ValueError(f"[{nodo.__name__}] escribe claves fuera de {salida.__name__}: {sorted(extra)}")
+        return out
+    return nodo_validado
+
+
 builder = StateGraph(WorkflowState)
 
 # Nodos principales
 builder.add_node("entrada_prompt", entrada_prompt_node)
 
 # Nodos paralelos tras entrada_prompt
-builder.add_node("generar_pieza", generar_pieza_node)
-builder.add_node("questions", questions_node)
-
-# Nodos aguas abajo que reciben subestados
-builder.add_node("extraer_codigo", extraer_codigo_node)
-builder.add_node("ejecutar_codigo", ejecutar_codigo_node)
-builder.add_node("fotografo", fotografo_node)
-builder.add_node("answers", answers_node, defer=True)
-builder.add_node("feedback", feedback_node)
-builder.add_node("feedforward", feedforward_node)
-builder.add_node("cleanup", cleanup_node)
-builder.add_node("reparador", reparador_node)
+builder.add_node("plantilla", validar_salida(plantilla_node))
+builder.add_node("generar_pieza", validar_salida(generar_pieza_node))
+builder.add_node("questions", validar_salida(questions_node))
+
+# Descomposición opcional en subpiezas generadas en paralelo y ensambladas
+builder.add_node("descomponer", validar_salida(descomponer_node))
+builder.add_node("subpieza", validar_salida(subpieza_node))
+builder.add_node("ensamblar", validar_salida(ensamblar_node))
+
+# Nodos aguas abajo: leen el estado compacto y escriben solo su subestado
+builder.add_node("extraer_codigo", validar_salida(extraer_codigo_node))
+builder.add_node("ejecutar_codigo", validar_salida(ejecutar_codigo_node))
+builder.add_node("fotografo", validar_salida(fotografo_node))
+builder.add_node("answers", validar_salida(answers_node), defer=True)
+builder.add_node("feedback", validar_salida(feedback_node))
+builder.add_node("feedforward", validar_salida(feedforward_node))
+builder.add_node("cleanup", validar_salida(cleanup_node))
+builder.add_node("reparador", validar_salida(reparador_node))
 
 
 # 1. Inicio
 builder.add_edge(START, "entrada_prompt")
 
-# 2. El prompt pasa por 'generar_pieza' y 'questions' en paralelo
-builder.add_edge("entrada_prompt", "generar_pieza")
-builder.add_edge("entrada_prompt", "questions")
+# 2. El prompt pasa por 'plantilla' y 'questions' en paralelo, o por 'descomponer' si está activada
 
-# 3. 'generar_pieza' -> 'extraer_codigo'
+def ruta_despues_de_entrada(state):
+    if state.get("descomponer") or os.getenv("CQ_DESCOMPONER") == "1":
+        return ["descomponer"]
+    else:
+        return ["plantilla", "questions"]
+
+builder.add_conditional_edges(
+    "entrada_prompt",
+    ruta_despues_de_entrada,
+    ["descomponer", "plantilla", "questions"]
+)
+
+# 2b. 'descomponer' lanza una 'subpieza' por componente (en paralelo, cada una se genera,
+#     ejecuta y repara de forma aislada); si la pieza no se descompone, sigue por 'plantilla'.
+#     'questions' se lanza aquí junto con las subpiezas y no desde 'entrada_prompt': un paso
+#     con solo tareas Send se toma como el último y ejecutaría antes de tiempo el nodo diferido 'answers'.
+#     'ensamblar' une los .step de las subpiezas y su script pasa por 'ejecutar_codigo' como cualquier otro.
+
+def ruta_despues_de_descomponer(state):
+    plan = state.get("plan_subpiezas")
+    if not plan:
+        return ["plantilla", "questions"]
+    nombre_pieza = state.get("nombre_pieza")
+    return ["questions"] + [
+        Send("subpieza", {"subpieza": {**sub, "indice": i, "nombre_pieza": f"{nombre_pieza}__{i}"}})
+        for i, sub in enumerate(plan)
+    ]
+
+builder.add_conditional_edges("descomponer", ruta_despues_de_descomponer, ["subpieza", "plantilla", "questions"])
+builder.add_edge("subpieza", "ensamblar")
+
+def ruta_despues_de_ensamblar(state):
+    if state.get("codigo_extraido"):
+        return "ejecutar_codigo"
+    else:
+        return "generar_pieza"
+
+builder.add_conditional_edges(
+    "ensamblar",
+    ruta_despues_de_ensamblar,
+    {"ejecutar_codigo": "ejecutar_codigo", "generar_pieza": "generar_pieza"}
+)
+
+# 3. 'plantilla' emite el código directamente si reconoce una pieza primitiva;
+#    si no, la pieza se genera con el LLM en 'generar_pieza' -> 'extraer_codigo'
+
+def ruta_despues_de_plantilla(state):
+    if state.get("plantilla"):
+        return "ejecutar_codigo"
+    else:
+        return "generar_pieza"
+
+builder.add_conditional_edges(
+    "plantilla",
+    ruta_despues_de_plantilla,
+    {"ejecutar_codigo": "ejecutar_codigo", "generar_pieza": "generar_pieza"}
+)
 builder.add_edge("generar_pieza", "extraer_codigo")
 
 # 4. 'extraer_codigo' -> 'ejecutar_codigo'
@@ -78,23 +168,27 @@ builder.add_edge("answers", "feedback")
 
 def ruta_despues_de_feedback(state):
     if state.get("resultado_feedback") == "ok":
-        return END
+        return "cleanup"
     else:
         return "feedforward"
 
 builder.add_conditional_edges(
     "feedback",
     ruta_despues_de_feedback,
-    {END: END, "feedforward": "feedforward"}
+    {"cleanup": "cleanup", "feedforward": "feedforward"}
 )
 
-# 11. 'feedforward' -> 'extraer_codigo' (ciclo)
+# 'cleanup' archiva las salidas de la ejecución y aplica la retención antes de terminar
+builder.add_edge("cleanup", END)
+
+# 11. 'feedforward' regenera el código con el contexto de la iteración -> 'extraer_codigo' (ciclo)
 builder.add_edge("feedforward", "extraer_codigo")
 
 # 12. Ejemplo de input inicial esperado:
 # {
 #     "nombre_pieza": "cubo_con_agujero",  # Nombre único de la pieza
-#     "prompt_entrada": "Genera un cubo de 10x10x10 con un agujero cilíndrico..."
+#     "prompt_entrada": "Genera un cubo de 10x10x10 con un agujero cilíndrico...",
+#     "descomponer": False  # Opcional: dividir la pieza en subpiezas (o CQ_DESCOMPONER=1)
 # }
 # Compila el grafo
 graph = builder.compile()
@@ -1,17 +1,18 @@
 from typing import Dict
 from src.utils.parts.qa_verification import answer_verification_questions
+from src.utils.parts.artefactos import guardar_artefacto
 
-from src.types import AnswersState, FotografoState, QuestionsState
+from src.types import AnswersState, WorkflowState
 
-def answers_node(state: dict) -> AnswersState:
+def answers_node(state: WorkflowState) -> AnswersState:
     """
     Espera:
-        state['questions']['preguntas_verificacion']: List[str]
-        state['fotografo']['imagenes_step']: List[str]
+        state['preguntas_verificacion']: str
+        state['imagenes_step']: List[str]
     """
     print(f"--- Nodo: answers ---")
-    preguntas = state.get('questions', {}).get('preguntas_verificacion', [])
-    imagenes = state.get('fotografo', {}).get('imagenes_step', [])
+    preguntas = state.get('preguntas_verificacion', [])
+    imagenes = state.get('imagenes_step', [])
 
     if isinstance(preguntas, list):
         preguntas_str = "\n".join(str(q) for q in preguntas)
@@ -19,4 +20,4 @@ def answers_node(state: dict) -> AnswersState:
         preguntas_str = str(preguntas)
 
     respuestas = answer_verification_questions(imagenes, preguntas_str)
-    return {'respuestas_ia_verificacion': respuestas}
+    return {'respuestas_ia_verificacion': guardar_artefacto(respuestas, "respuestas", run_id=state.get('run_id'))}
@@ -1,7 +1,21 @@
 import os
 from typing import Dict
+from src.utils.parts.artefactos import archivar_parts, registrar_en_manifiesto, gc
 
-def cleanup_node(state) -> Dict:
+from src.types import EstadoBase, WorkflowState
+
+# Claves del estado que apuntan a artefactos y se conservan con la ejecución
+CLAVES_ARTEFACTO = ["raw_llm_output", "codigo_extraido", "error_ejecucion", "respuestas_ia_verificacion", "feedback"]
+
+def cleanup_node(state: WorkflowState) -> EstadoBase:
+    """
+    Etapa de retención al final de la ejecución:
+      - guarda en el almacén de artefactos (deduplicado y comprimido) todo lo que hay en parts/<nombre_pieza>/
+        y en los directorios de sus subpiezas,
+      - deja en parts/<nombre_pieza>/ solo las salidas finales (.py, .step e imágenes de la última iteración),
+      - registra en el manifiesto de la ejecución esos archivos y los artefactos del estado y la cierra como 'ok',
+      - aplica la política de GC si CQ_GC_MAX_BYTES o CQ_GC_MAX_EDAD_DIAS están definidas.
+    """
     print(f"--- Nodo: cleanup ---")
     # Limpieza de archivos temporales generados durante el flujo
     temp_files = ["tmp/llm_code.py"]
@@ -12,4 +26,41 @@ def cleanup_node(state) -> Dict:
                 print(f"Archivo temporal eliminado: {f}")
         except Exception as e:
             print(f"Error al eliminar {f}: {e}")
-    return state
+
+    nombre_pieza = state.get('nombre_pieza')
+    run_id = state.get('run_id') or nombre_pieza
+    if not nombre_pieza:
+        return {}
+
+    conservar = {f"{nombre_pieza}.py", f"{nombre_pieza}.step"}
+    conservar |= {os.path.basename(p) for p in state.get('imagenes_step') or []}
+    subpiezas = [sub['nombre_pieza'] for sub in state.get('subpiezas') or []]
+    entradas = archivar_parts(nombre_pieza, conservar, subpiezas)
+
+    for clave in CLAVES_ARTEFACTO:
+        ref = state.get(clave)
+        if ref:
+            entradas.append({'sha256': ref['id'], 'nombre': f"estado/{clave}", 'tipo': ref['tipo'], 'bytes': ref['bytes']})
+    for paso in state.get('historial') or []:
+        if paso.get('artefacto_id'):
+            entradas.append({'sha256': paso['artefacto_id'], 'nombre': f"historial/{paso.get('n')}/{paso.get('etapa')}", 'tipo': "historial"})
+
+    registrar_en_manifiesto(run_id, entradas, {
+        'nombre_pieza': nombre_pieza,
+        'prompt_entrada': state.get('prompt_entrada'),
+        'resultado_feedback': state.get('resultado_feedback'),
+        'estado': "ok",
+    })
+    print(f"    {len(entradas)} artefactos registrados en el manifiesto {run_id}")
+
+    max_bytes = os.getenv("CQ_GC_MAX_BYTES")
+    max_edad_dias = os.getenv("CQ_GC_MAX_EDAD_DIAS")
+    if max_bytes or max_edad_dias:
+        resultado = gc(
+            max_bytes=int(max_bytes) if max_bytes else None,
+            max_edad_dias=float(max_edad_dias) if max_edad_dias else None,
+            abandono_dias=float(os.getenv("CQ_GC_ABANDONO_DIAS", "7"))
+        )
+        print(f"    GC: {resultado['objetos_eliminados']} objetos y {len(resultado['manifiestos_eliminados'])} ejecuciones eliminadas, "
+              f"{resultado['bytes_liberados'] / 1024 ** 2:.1f} MiB liberados")
+    return {}
@@ -0,0 +1,24 @@
+from langgraph.errors import GraphInterrupt
+from src.utils.parts.descomposicion import descomponer_prompt
+
+from src.types import DescomponerState, WorkflowState
+
+def descomponer_node(state: WorkflowState) -> DescomponerState:
+    print(f"--- Nodo: descomponer ---")
+    prompt = state.get('prompt_entrada', '')
+    try:
+        plan = descomponer_prompt(prompt)
+    except GraphInterrupt:
+        raise
+    except Exception as e:
+        print(f"Error al descomponer la pieza: {e}")
+        plan = []
+    if len(plan) < 2:
+        # Una sola subpieza no aporta nada: se sigue por la vía normal (plantilla / generar_pieza)
+        print("    La pieza no se descompone; se genera completa.")
+        return {'plan_subpiezas': None}
+    print(f"    {len(plan)} subpiezas: {[sub['nombre'] for sub in plan]}")
+    return {
+        'plan_subpiezas': plan,
+        'historial': [{'etapa': "descomponer", 'resultado': f"{len(plan)} subpiezas", 'resumen': ", ".join(sub['nombre'] for sub in plan)[:160]}]
+    }
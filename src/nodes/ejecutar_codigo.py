@@ -1,34 +1,57 @@
 from src.utils.parts.codigo import save_llm_code_to_file, execute_cadquery_script
+from src.utils.parts.errores import registrar_resultado_reparacion
+from src.utils.parts.modelos import registrar_resultado
+from src.utils.parts.artefactos import guardar_artefacto, cargar_artefacto, resumir
 
-from src.types import EjecutarCodigoState, ExtraerCodigoState
+from src.types import EjecutarCodigoState, WorkflowState
 
-def ejecutar_codigo_node(state: ExtraerCodigoState) -> EjecutarCodigoState:
+def ejecutar_codigo_node(state: WorkflowState) -> EjecutarCodigoState:
     print(f"--- Nodo: ejecutar_codigo ---")
-    codigo = state.get('codigo_extraido', '')
+    codigo_ref = state.get('codigo_extraido')
+    codigo = cargar_artefacto(codigo_ref) or ''
     nombre_pieza = state.get('nombre_pieza')
     if not codigo:
+        mensaje = "No se encontró código para ejecutar."
         return {
             'resultado_ejecucion_step': "error :(",
-            'error_ejecucion': "No se encontró código para ejecutar.",
+            'error_ejecucion': guardar_artefacto(mensaje, "error", run_id=state.get('run_id')),
             'step_path': None,
-            'nombre_pieza': nombre_pieza
+            'nombre_pieza': nombre_pieza,
+            'historial': [{'etapa': "ejecutar_codigo", 'resultado': "error", 'resumen': mensaje}]
         }
 
     # Guardar el .py en la ruta correcta
     py_file_path = save_llm_code_to_file(codigo, nombre_pieza)
     # Ejecutar y buscar el .step en la ruta correcta
     result = execute_cadquery_script(nombre_pieza)
+
+    # Si este código viene del reparador, se anota el resultado en la base de conocimiento de errores
+    pendiente = state.get('reparacion_pendiente')
+    if pendiente:
+        registrar_resultado_reparacion({
+            'error': cargar_artefacto(pendiente['error_id']),
+            'codigo_fallido': cargar_artefacto(pendiente['codigo_fallido_id']),
+            'origen': pendiente['origen']
+        }, codigo, result["ok"])
+        if pendiente.get('modelo'):
+            registrar_resultado("reparador", pendiente['modelo'], result["ok"])
+
     if result["ok"]:
         return {
             'resultado_ejecucion_step': "ok",
             'error_ejecucion': None,
             'step_path': result["step_path"],
-            'nombre_pieza': nombre_pieza
+            'nombre_pieza': nombre_pieza,
+            'reparacion_pendiente': None,
+            'historial': [{'etapa': "ejecutar_codigo", 'resultado': "ok", 'resumen': result["step_path"], 'artefacto_id': codigo_ref['id']}]
         }
     else:
+        # Del traceback solo se resume la última línea (tipo y mensaje de la excepción)
+        error_ref = guardar_artefacto(result["error"], "error", resumen=resumir(result["error"], ultima_linea=True), run_id=state.get('run_id'))
         return {
             'resultado_ejecucion_step': "error :(",
-            'error_ejecucion': result["error"],
+            'error_ejecucion': error_ref,
             'step_path': None,
-            'nombre_pieza': nombre_pieza
+            'nombre_pieza': nombre_pieza,
+            'historial': [{'etapa': "ejecutar_codigo", 'resultado': "error", 'resumen': error_ref['resumen'], 'artefacto_id': codigo_ref['id']}]
         }
@@ -0,0 +1,30 @@
+from src.utils.parts.descomposicion import generar_codigo_ensamblaje
+from src.utils.parts.artefactos import guardar_artefacto
+
+from src.types import EnsamblarState, WorkflowState
+
+def ensamblar_node(state: WorkflowState) -> EnsamblarState:
+    print(f"--- Nodo: ensamblar ---")
+    nombre_pieza = state.get('nombre_pieza')
+    subpiezas = sorted(state.get('subpiezas') or [], key=lambda s: s['indice'])
+    validas = [s for s in subpiezas if s['ok']]
+    # Sin cuerpo base sobre el que restar, los cortes iniciales no tienen sentido
+    while validas and validas[0]['operacion'] == "corte":
+        validas.pop(0)
+    fallidas = [s['nombre'] for s in subpiezas if s not in validas]
+    if fallidas:
+        print(f"    Subpiezas descartadas del ensamblaje: {fallidas}")
+    if not validas:
+        print("    Ninguna subpieza válida: se genera la pieza completa.")
+        return {'codigo_extraido': None, 'historial': [{'etapa': "ensamblar", 'resultado': "error", 'resumen': "ninguna subpieza válida"}]}
+
+    # El ensamblaje es determinista: importa cada .step, lo coloca y lo une o lo resta
+    codigo = generar_codigo_ensamblaje(nombre_pieza, validas)
+    print(codigo)
+    codigo_ref = guardar_artefacto(codigo, "codigo", run_id=state.get('run_id'))
+    return {
+        'raw_llm_output': guardar_artefacto(f"```python\n{codigo}\n```", "llm", run_id=state.get('run_id')),
+        'codigo_extraido': codigo_ref,
+        'historial': [{'etapa': "ensamblar", 'resultado': f"{len(validas)}/{len(subpiezas)} subpiezas",
+                       'resumen': f"descartadas: {fallidas}" if fallidas else "todas las subpiezas ok", 'artefacto_id': codigo_ref['id']}]
+    }
@@ -1,4 +1,7 @@
+import time
+import uuid
 from typing import Dict, Any
+from src.utils.parts.artefactos import registrar_en_manifiesto
 from src.types import WorkflowState
 
 def entrada_prompt_node(state: WorkflowState) -> Dict[str, Any]:
@@ -10,4 +13,15 @@ def entrada_prompt_node(state: WorkflowState) -> Dict[str, Any]:
     if not state.get('nombre_pieza'):
         print("    Estableciendo nombre de pieza de ejemplo.")
         out["nombre_pieza"] = "cubo_con_agujero"
+    nombre_pieza = state.get('nombre_pieza') or out["nombre_pieza"]
+    run_id = state.get('run_id')
+    if not run_id:
+        # Identificador de la ejecución para su manifiesto en el almacén de artefactos
+        run_id = out["run_id"] = f"{nombre_pieza}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    # El manifiesto se abre 'en_curso' desde el principio: el GC respeta sus artefactos aunque la
+    # ejecución quede suspendida o falle antes de 'cleanup'
+    registrar_en_manifiesto(run_id, [], {
+        'nombre_pieza': nombre_pieza,
+        'prompt_entrada': state.get('prompt_entrada') or out.get("prompt_entrada"),
+    })
     return out
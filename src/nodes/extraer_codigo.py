@@ -1,13 +1,10 @@
 from src.utils.parts.codigo import extract_code_from_response
-from src.types import ExtraerCodigoState, GenerarPiezaState
+from src.utils.parts.artefactos import guardar_artefacto, cargar_artefacto
+from src.types import ExtraerCodigoState, WorkflowState
 
-def extraer_codigo_node(state: GenerarPiezaState) -> ExtraerCodigoState:
+def extraer_codigo_node(state: WorkflowState) -> ExtraerCodigoState:
     print(f"--- Nodo: extraer_codigo ---")
-    raw_response = state.get('raw_llm_output', '')
+    raw_response = cargar_artefacto(state.get('raw_llm_output')) or ''
     nombre_pieza = state.get('nombre_pieza')
-    if isinstance(raw_response, list):
-        raw_response = "\n".join(str(x) for x in raw_response)
-    if raw_response is None:
-        raw_response = ''
     clean_code = extract_code_from_response(raw_response, nombre_pieza)
-    return {'codigo_extraido': clean_code}
+    return {'codigo_extraido': guardar_artefacto(clean_code, "codigo", run_id=state.get('run_id'))}
@@ -1,10 +1,45 @@
+import os
 from typing import Dict
-from src.utils.parts.qa_verification import generate_feedback
+from src.utils.parts.qa_verification import generate_feedback, parse_verification_answers
+from src.utils.parts.ejemplos import registrar_ejemplo
+from src.utils.parts.artefactos import guardar_artefacto, cargar_artefacto
 
-from src.types import FeedbackState, AnswersState
+from src.types import FeedbackState, WorkflowState
 
-def feedback_node(state: AnswersState) -> FeedbackState:
+def registrar_subpiezas(subpiezas: list) -> None:
+    """
+    El script de ensamblaje importa los .step de las subpiezas de esta ejecución y no sirve como
+    ejemplo para otra pieza: se indexa el código de cada subpieza generada por el LLM con su descripción.
+    """
+    for sub in subpiezas:
+        if not sub['ok'] or not (sub.get('origen') or "").startswith("llm"):
+            continue
+        ruta = os.path.join("parts", sub['nombre_pieza'], f"{sub['nombre_pieza']}.py")
+        if os.path.exists(ruta):
+            with open(ruta, "r", encoding="utf-8") as f:
+                registrar_ejemplo(sub['descripcion'], f.read(), [], sub['nombre_pieza'])
+
+def feedback_node(state: WorkflowState) -> FeedbackState:
     print(f"--- Nodo: feedback ---")
-    respuestas = state.get('respuestas_ia_verificacion', {})
+    respuestas = cargar_artefacto(state.get('respuestas_ia_verificacion')) or ""
+    veredictos = parse_verification_answers(respuestas)
+    fallidas = [v['question'] for v in veredictos if v['answer'] != "Yes"]
+    if veredictos and not fallidas:
+        # Pieza verificada: se indexa para usarla como ejemplo few-shot en futuras ejecuciones
+        codigo = cargar_artefacto(state.get('codigo_extraido'))
+        if state.get('plan_subpiezas') and "importStep(" in (codigo or ""):
+            registrar_subpiezas(state.get('subpiezas') or [])
+        else:
+            registrar_ejemplo(state.get('prompt_entrada'), codigo, veredictos, state.get('nombre_pieza'))
+        return {
+            'resultado_feedback': "ok",
+            'feedback': None,
+            'historial': [{'etapa': "feedback", 'resultado': "ok", 'resumen': f"{len(veredictos)}/{len(veredictos)} preguntas Yes"}]
+        }
     resultado = generate_feedback(respuestas)
-    return {'resultado_feedback': resultado}
\ No newline at end of file
+    ref = guardar_artefacto(resultado, "feedback", run_id=state.get('run_id'))
+    return {
+        'resultado_feedback': "otro",
+        'feedback': ref,
+        'historial': [{'etapa': "feedback", 'resultado': "otro", 'resumen': f"Fallan: {'; '.join(fallidas)}"[:160], 'artefacto_id': ref['id']}]
+    }
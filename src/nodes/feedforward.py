@@ -1,8 +1,43 @@
-from typing import Dict
+from langgraph.errors import GraphInterrupt
+from src.utils.parts.codigo import condensar_contexto_iteracion, refine_cadquery_code
+from src.utils.parts.qa_verification import parse_verification_answers
+from src.utils.parts.ejemplos import estimar_tokens
+from src.utils.parts.artefactos import guardar_artefacto, cargar_artefacto
 
-from src.types import FeedbackState
+from src.types import FeedforwardState, WorkflowState
 
-def feedforward_node(state: FeedbackState) -> dict:
+def feedforward_node(state: WorkflowState) -> FeedforwardState:
     print(f"--- Nodo: feedforward ---")
-    # Nodo de paso para lógica condicional o reintentos.
-    return {}
+    codigo_previo = cargar_artefacto(state.get('codigo_extraido'))
+    if not codigo_previo:
+        print("No hay código previo que corregir. Ciclo sin cambios.")
+        return {}
+
+    # Contexto compacto: solo lo que falla y un resumen de los intentos, no las respuestas completas
+    respuestas = cargar_artefacto(state.get('respuestas_ia_verificacion')) or ""
+    fallidas = [v['question'] for v in parse_verification_answers(respuestas) if v['answer'] != "Yes"]
+    feedback = cargar_artefacto(state.get('feedback')) or ""
+    historial = state.get('historial') or []
+    contexto = condensar_contexto_iteracion(fallidas, feedback, historial)
+    # Cada regeneración que vuelve a fallar la verificación escala al siguiente modelo de la ruta.
+    # Se cuenta en el estado y no en el historial, que solo conserva las últimas entradas
+    nivel = state.get('feedforward_intentos') or 0
+    print(f"    {len(fallidas)} preguntas a corregir, contexto de ~{estimar_tokens(contexto)} tokens (nivel {nivel})")
+
+    try:
+        raw_llm_output, modelo = refine_cadquery_code(state.get('prompt_entrada'), codigo_previo, contexto,
+                                                      state.get('nombre_pieza'), nivel=nivel)
+        print(f"Código regenerado por LLM ({modelo}):")
+        print(raw_llm_output)
+    except GraphInterrupt:
+        raise
+    except Exception as e:
+        print(f"Error al regenerar código con LLM: {e}")
+        return {'feedforward_intentos': nivel + 1}
+
+    ref = guardar_artefacto(raw_llm_output, "llm", run_id=state.get('run_id'))
+    return {
+        'raw_llm_output': ref,
+        'feedforward_intentos': nivel + 1,
+        'historial': [{'etapa': "feedforward", 'resultado': f"llm:{modelo}", 'resumen': f"{len(fallidas)} preguntas a corregir", 'artefacto_id': ref['id']}]
+    }
@@ -2,9 +2,9 @@ import os
 from typing import Dict
 from src.utils.parts.fotos import generate_cad_images_from_step
 
-from src.types import FotografoState, EjecutarCodigoState
+from src.types import FotografoState, WorkflowState
 
-def fotografo_node(state: EjecutarCodigoState) -> FotografoState:
+def fotografo_node(state: WorkflowState) -> FotografoState:
     print(f"--- Nodo: fotografo ---")
     step_path = state.get('step_path')
     nombre_pieza = state.get('nombre_pieza')
@@ -1,55 +1,28 @@
-import os
-from openai import OpenAI
+from langgraph.errors import GraphInterrupt
 from src.types import GenerarPiezaState, WorkflowState
+from src.utils.parts.codigo import generate_cadquery_code
+from src.utils.parts.artefactos import guardar_artefacto
 
 def generar_pieza_node(state: WorkflowState) -> GenerarPiezaState:
     print(f"--- Nodo: generar_pieza ---")
     prompt = state.get('prompt_entrada')
     if not prompt:
-        state['raw_llm_output'] = None
         print("No se proporcionó prompt de entrada.")
-        return state
-
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        print("OPENAI_API_KEY no configurada en entorno.")
-        state['raw_llm_output'] = None
-        return state
-
-    client = OpenAI(api_key=api_key)
-
-    system_prompt = (
-        "Eres un asistente experto en diseño mecánico y modelado 3D con CadQuery. "
-        "Cuando recibas una descripción en lenguaje natural de una pieza, "
-        "responde con un solo bloque de código Python que utilice CadQuery para generar la pieza, "
-        "y añade una línea que exporte el modelo a formato .step con un nombre claro. "
-        "No incluyas explicaciones ni texto fuera del bloque de código. "
-        "Ejemplo:\n"
-        "```python\n"
-        "import cadquery as cq\n"
-        "# ...código...\n"
-        "cq.exporters.export(pieza_final, 'mi_pieza.step')\n"
-        "```"
-    )
-
-    user_prompt = prompt
+        return {'raw_llm_output': None}
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.1,
-            max_tokens=900
-        )
-        raw_llm_output = response.choices[0].message.content
-        state['raw_llm_output'] = raw_llm_output
-        print("Código generado por LLM:")
+        raw_llm_output, modelo, n_ejemplos = generate_cadquery_code(prompt, state.get('nombre_pieza'))
+        print(f"Código generado por LLM ({modelo}):")
         print(raw_llm_output)
+    except GraphInterrupt:
+        # En modo lote la petición queda encolada y el grafo se suspende hasta ingerir el resultado
+        raise
     except Exception as e:
         print(f"Error al generar código con LLM: {e}")
-        state['raw_llm_output'] = None
+        return {'raw_llm_output': None}
 
-    return state
+    ref = guardar_artefacto(raw_llm_output, "llm", run_id=state.get('run_id'))
+    return {
+        'raw_llm_output': ref,
+        'historial': [{'etapa': "generar_pieza", 'resultado': "ok", 'resumen': f"{n_ejemplos} ejemplos few-shot", 'artefacto_id': ref['id']}]
+    }
@@ -0,0 +1,31 @@
+from src.utils.parts.plantillas import (
+    extraer_plantilla, generar_codigo_plantilla, registrar_uso_plantilla, resumen_estadisticas, CONFIANZA_MINIMA
+)
+from src.utils.parts.artefactos import guardar_artefacto
+
+from src.types import PlantillaState, WorkflowState
+
+def plantilla_node(state: WorkflowState) -> PlantillaState:
+    print(f"--- Nodo: plantilla ---")
+    prompt = state.get('prompt_entrada')
+    nombre_pieza = state.get('nombre_pieza')
+    intencion = extraer_plantilla(prompt)
+    if not intencion or intencion['confianza'] < CONFIANZA_MINIMA:
+        if intencion:
+            print(f"    Plantilla '{intencion['plantilla']}' descartada (confianza {intencion['confianza']}).")
+        registrar_uso_plantilla(None)
+        print(resumen_estadisticas())
+        return {'plantilla': None}
+
+    # Pieza primitiva reconocida: el código sale directamente de la plantilla, sin LLM
+    codigo = generar_codigo_plantilla(intencion, nombre_pieza)
+    registrar_uso_plantilla(intencion['plantilla'])
+    print(f"    Plantilla '{intencion['plantilla']}' aplicada (confianza {intencion['confianza']}): {intencion['params']}")
+    print(resumen_estadisticas())
+    codigo_ref = guardar_artefacto(codigo, "codigo", run_id=state.get('run_id'))
+    return {
+        'plantilla': {k: intencion[k] for k in ('plantilla', 'params', 'confianza')},
+        'raw_llm_output': guardar_artefacto(f"```python\n{codigo}\n```", "llm", run_id=state.get('run_id')),
+        'codigo_extraido': codigo_ref,
+        'historial': [{'etapa': "plantilla", 'resultado': intencion['plantilla'], 'resumen': str(intencion['params'])[:160], 'artefacto_id': codigo_ref['id']}]
+    }
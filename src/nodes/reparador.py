@@ -1,19 +1,36 @@
 from typing import Dict
-from src.utils.parts.codigo import repair_cadquery_code
+from langgraph.errors import GraphInterrupt
+from src.utils.parts.codigo import reparar_codigo
+from src.utils.parts.artefactos import guardar_artefacto, cargar_artefacto
 
-from src.types import EjecutarCodigoState, GenerarPiezaState
+from src.types import ReparadorState, WorkflowState
 
-def reparador_node(state: EjecutarCodigoState) -> GenerarPiezaState:
+def reparador_node(state: WorkflowState) -> ReparadorState:
     print(f"--- Nodo: reparador ---")
-    codigo_fallido = state.get('codigo_extraido', '')
-    mensaje_error = state.get('error_ejecucion', '')
+    codigo_ref = state.get('codigo_extraido')
+    error_ref = state.get('error_ejecucion')
+    codigo_fallido = cargar_artefacto(codigo_ref) or ''
+    mensaje_error = cargar_artefacto(error_ref) or ''
     if not codigo_fallido or not mensaje_error:
         print("No hay código ni error para reparar. Ciclo sin cambios.")
-        return state
-    print("Llamando a LLM para intentar reparar el código CadQuery...")
+        return {}
+    pendiente_nuevo = {'error_id': error_ref['id'], 'codigo_fallido_id': codigo_ref['id']}
+
+    # Reparación local si hay una aplicable; si la anterior ya fue local y ha fallado, el LLM
     try:
-        codigo_reparado = repair_cadquery_code(codigo_fallido, mensaje_error)
-        return {'raw_llm_output': codigo_reparado}
+        reparacion = reparar_codigo(codigo_fallido, mensaje_error, state.get('reparacion_pendiente'))
+    except GraphInterrupt:
+        raise
     except Exception as e:
         print(f"Error durante la reparación automática: {e}")
-        return {'raw_llm_output': f"Error en reparación automática: {str(e)}"}
+        return {'raw_llm_output': guardar_artefacto(f"Error en reparación automática: {str(e)}", "llm", run_id=state.get('run_id'))}
+
+    origen, modelo = reparacion['origen'], reparacion['modelo']
+    pendiente_nuevo.update({'origen': origen, 'nivel': reparacion['nivel']})
+    if modelo:
+        pendiente_nuevo['modelo'] = modelo
+    return {
+        'raw_llm_output': guardar_artefacto(reparacion['codigo'], "llm", run_id=state.get('run_id')),
+        'reparacion_pendiente': pendiente_nuevo,
+        'historial': [{'etapa': "reparador", 'resultado': f"llm:{modelo}" if modelo else origen, 'resumen': error_ref['resumen']}]
+    }
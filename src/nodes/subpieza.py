@@ -0,0 +1,72 @@
+from typing import Dict
+from langgraph.errors import GraphInterrupt
+from src.utils.parts.codigo import (
+    generate_cadquery_code, extract_code_from_response, save_llm_code_to_file, execute_cadquery_script, reparar_codigo
+)
+from src.utils.parts.plantillas import extraer_plantilla, generar_codigo_plantilla, registrar_uso_plantilla, CONFIANZA_MINIMA
+from src.utils.parts.descomposicion import MAX_REPARACIONES_SUBPIEZA
+from src.utils.parts.errores import registrar_resultado_reparacion
+from src.utils.parts.modelos import registrar_resultado
+from src.utils.parts.artefactos import resumir
+
+from src.types import SubpiezaState
+
+def subpieza_node(state: Dict) -> SubpiezaState:
+    """
+    Genera, ejecuta y repara una subpieza de forma aislada. Se lanza con Send una vez por subpieza
+    del plan, así que recibe solo {'subpieza': {...}} y no el estado global; los errores se reparan
+    aquí mismo (hasta MAX_REPARACIONES_SUBPIEZA veces) sin pasar por el ciclo del grafo.
+    """
+    sub = state['subpieza']
+    nombre_pieza = sub['nombre_pieza']
+    print(f"--- Nodo: subpieza ({nombre_pieza}: {sub['nombre']}) ---")
+    resultado = {**sub, 'ok': False, 'origen': None, 'intentos': 0, 'error': None}
+
+    # Las subpiezas suelen ser primitivas: primero la vía rápida de plantillas
+    intencion = extraer_plantilla(sub['descripcion'])
+    if intencion and intencion['confianza'] >= CONFIANZA_MINIMA:
+        registrar_uso_plantilla(intencion['plantilla'])
+        codigo = generar_codigo_plantilla(intencion, nombre_pieza)
+        resultado['origen'] = f"plantilla:{intencion['plantilla']}"
+    else:
+        registrar_uso_plantilla(None)
+        try:
+            raw_llm_output, modelo, _ = generate_cadquery_code(sub['descripcion'], nombre_pieza)
+        except GraphInterrupt:
+            raise
+        except Exception as e:
+            print(f"Error al generar la subpieza {nombre_pieza}: {e}")
+            resultado['error'] = resumir(str(e))
+            return {'subpiezas': [resultado]}
+        codigo = extract_code_from_response(raw_llm_output, nombre_pieza)
+        resultado['origen'] = f"llm:{modelo}"
+
+    pendiente = None
+    for intento in range(MAX_REPARACIONES_SUBPIEZA + 1):
+        resultado['intentos'] = intento + 1
+        save_llm_code_to_file(codigo, nombre_pieza)
+        ejecucion = execute_cadquery_script(nombre_pieza)
+        if pendiente:
+            registrar_resultado_reparacion(pendiente, codigo, ejecucion["ok"])
+            if pendiente.get('modelo'):
+                registrar_resultado("reparador", pendiente['modelo'], ejecucion["ok"])
+        if ejecucion["ok"]:
+            resultado.update({'ok': True, 'error': None})
+            break
+        resultado['error'] = resumir(ejecucion["error"], ultima_linea=True)
+        print(f"    {nombre_pieza}: intento {intento + 1} fallido ({resultado['error']})")
+        if intento == MAX_REPARACIONES_SUBPIEZA:
+            break
+        try:
+            reparacion = reparar_codigo(codigo, ejecucion["error"], pendiente)
+        except GraphInterrupt:
+            raise
+        except Exception as e:
+            print(f"Error durante la reparación de {nombre_pieza}: {e}")
+            break
+        pendiente = {'error': ejecucion["error"], 'codigo_fallido': codigo,
+                     'origen': reparacion['origen'], 'modelo': reparacion['modelo'], 'nivel': reparacion['nivel']}
+        codigo = extract_code_from_response(reparacion['codigo'], nombre_pieza)
+
+    print(f"    {nombre_pieza}: {'ok' if resultado['ok'] else 'fallida'} tras {resultado['intentos']} intentos ({resultado['origen']})")
+    return {'subpiezas': [resultado]}
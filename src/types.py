@@ -1,32 +1,87 @@
+import operator
 from typing import Optional, List, Dict, Literal
-from typing_extensions import TypedDict
+from typing_extensions import Annotated, TypedDict
 
-# Estado global compartido (público)
-class WorkflowState(TypedDict, total=False):
+# Número máximo de iteraciones que se conservan en el historial del estado
+MAX_HISTORIAL = 8
+
+# Referencia a un texto voluminoso guardado en el almacén de artefactos (src/utils/parts/artefactos.py)
+class ArtefactoRef(TypedDict):
+    id: str  # SHA-256 del contenido
+    tipo: str
+    bytes: int
+    resumen: str
+
+# Resumen compacto de un paso del ciclo generar/ejecutar/verificar
+class ResumenIteracion(TypedDict, total=False):
+    n: int
+    etapa: str
+    resultado: str
+    resumen: str
+    artefacto_id: Optional[str]
+
+def anillo_historial(actual: Optional[List[ResumenIteracion]], nuevo: Optional[List[ResumenIteracion]]) -> List[ResumenIteracion]:
+    """Reducer del historial: añade las entradas nuevas numeradas y conserva solo las MAX_HISTORIAL últimas."""
+    historial = list(actual or [])
+    siguiente = historial[-1].get("n", len(historial)) + 1 if historial else 1
+    for i, entrada in enumerate(nuevo or []):
+        historial.append({**entrada, "n": siguiente + i})
+    return historial[-MAX_HISTORIAL:]
+
+# Campos comunes que cualquier nodo puede escribir
+class EstadoBase(TypedDict, total=False):
     nombre_pieza: str  # Nombre único de la pieza, definido en el input inicial
     prompt_entrada: Optional[str]
-    # Puedes añadir aquí otros campos realmente globales si los necesitas
+    run_id: str  # Identificador de la ejecución (manifiesto en el almacén de artefactos)
+    historial: Annotated[List[ResumenIteracion], anillo_historial]
+
+# Subestados: cada nodo declara como tipo de retorno el subestado que escribe
+class GenerarPiezaState(EstadoBase):
+    raw_llm_output: Optional[ArtefactoRef]
+
+class QuestionsState(EstadoBase):
+    preguntas_verificacion: str
 
-# Subestados privados para cada nodo paralelo o rama
-class GenerarPiezaState(WorkflowState):
-    raw_llm_output: str
+class ExtraerCodigoState(EstadoBase):
+    codigo_extraido: Optional[ArtefactoRef]
 
-class QuestionsState(WorkflowState):
-    preguntas_verificacion: List[str]
+class PlantillaState(GenerarPiezaState, ExtraerCodigoState):
+    plantilla: Optional[Dict]  # {'plantilla', 'params', 'confianza'} si se usó la vía rápida sin LLM
 
-class ExtraerCodigoState(WorkflowState):
-    codigo_extraido: str
+class FeedforwardState(GenerarPiezaState):
+    feedforward_intentos: int  # Regeneraciones tras fallar la verificación; fija el nivel de la ruta de modelos
 
-class EjecutarCodigoState(WorkflowState):
+class ReparadorState(GenerarPiezaState):
+    reparacion_pendiente: Optional[Dict]  # {'error_id', 'codigo_fallido_id', 'origen'} de la última reparación aplicada
+
+class EjecutarCodigoState(EstadoBase):
     resultado_ejecucion_step: Literal["ok", "error :("]
-    error_ejecucion: Optional[str]
+    error_ejecucion: Optional[ArtefactoRef]
     step_path: Optional[str]
+    reparacion_pendiente: Optional[Dict]
 
-class FotografoState(WorkflowState):
+class FotografoState(EstadoBase):
     imagenes_step: List[str]
 
-class AnswersState(WorkflowState):
-    respuestas_ia_verificacion: Dict
+class AnswersState(EstadoBase):
+    respuestas_ia_verificacion: Optional[ArtefactoRef]
 
-class FeedbackState(WorkflowState):
+class FeedbackState(EstadoBase):
     resultado_feedback: Literal["ok", "otro"]
+    feedback: Optional[ArtefactoRef]
+
+class DescomponerState(EstadoBase):
+    descomponer: bool  # Activa la descomposición en subpiezas (también con CQ_DESCOMPONER=1)
+    plan_subpiezas: Optional[List[Dict]]  # [{'nombre', 'descripcion', 'posicion', 'operacion'}]
+
+class SubpiezaState(EstadoBase):
+    subpiezas: Annotated[List[Dict], operator.add]  # Un resultado por subpieza generada en paralelo
+
+class EnsamblarState(GenerarPiezaState, ExtraerCodigoState):
+    pass
+
+# Estado global compartido: unión compacta de todos los subestados
+class WorkflowState(GenerarPiezaState, QuestionsState, ExtraerCodigoState, PlantillaState, FeedforwardState, ReparadorState,
+                    EjecutarCodigoState, FotografoState, AnswersState, FeedbackState, DescomponerState,
+                    SubpiezaState, EnsamblarState):
+    pass
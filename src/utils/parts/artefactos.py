@@ -0,0 +1,389 @@
+import os
+import re
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+from typing import Optional
+
+import zstandard
+
+# Almacén de artefactos direccionado por contenido (SHA-256). Los textos voluminosos (salidas
+# del LLM, código, tracebacks, respuestas y feedback) se guardan aquí y el estado del grafo solo
+# lleva una referencia con el hash, el tamaño y un resumen corto. También guarda los archivos de
+# parts/<nombre_pieza>/ de cada ejecución: texto y STEP comprimidos con zstd, PNG tal cual
+# (ya están comprimidos) y enlazados de forma dura desde parts/ para no duplicarlos.
+#
+#   artefactos/objetos/ab/<sha256>[.zst]   contenido
+#   artefactos/manifiestos/<run_id>.sqlite  qué artefactos pertenecen a cada ejecución
+#
+# El manifiesto se abre con el primer artefacto de la ejecución (estado 'en_curso') y se cierra al
+# terminar ('ok'), al fallar ('fallida') o cuando el GC la da por abandonada ('abandonada').
+# El GC nunca elimina una ejecución en curso: puede estar suspendida esperando un lote.
+ARTEFACTOS_DIR = os.getenv("CQ_ARTEFACTOS_DIR", "artefactos")
+OBJETOS_DIR = os.path.join(ARTEFACTOS_DIR, "objetos")
+MANIFIESTOS_DIR = os.path.join(ARTEFACTOS_DIR, "manifiestos")
+
+MAX_RESUMEN = 160
+NIVEL_ZSTD = 9
+# Por debajo de este tamaño la compresión no compensa
+MIN_BYTES_COMPRESION = 256
+# Formatos que ya vienen comprimidos
+EXTENSIONES_SIN_COMPRESION = (".png", ".jpg", ".jpeg", ".zip", ".gz", ".zst")
+ESTADO_EN_CURSO = "en_curso"
+
+
+def resumir(texto: Optional[str], max_chars: int = MAX_RESUMEN, ultima_linea: bool = False) -> str:
+    """Primera (o última) línea no vacía del texto, recortada a max_chars."""
+    lineas = [l.strip() for l in (texto or "").splitlines() if l.strip()]
+    if not lineas:
+        return ""
+    linea = lineas[-1] if ultima_linea else lineas[0]
+    return linea if len(linea) <= max_chars else linea[:max_chars - 3] + "..."
+
+
+def _ruta_objeto(digest: str, comprimido: bool) -> str:
+    return os.path.join(OBJETOS_DIR, digest[:2], digest + (".zst" if comprimido else ""))
+
+
+def _buscar_objeto(digest: str) -> Optional[str]:
+    for comprimido in (True, False):
+        ruta = _ruta_objeto(digest, comprimido)
+        if os.path.exists(ruta):
+            return ruta
+    return None
+
+
+def _guardar_objeto(datos: bytes, comprimir: bool) -> tuple:
+    """Guarda los bytes si no existían. Devuelve (sha256, ruta del objeto, bytes en disco)."""
+    digest = hashlib.sha256(datos).hexdigest()
+    ruta = _buscar_objeto(digest)
+    if ruta is None:
+        comprimir = comprimir and len(datos) >= MIN_BYTES_COMPRESION
+        ruta = _ruta_objeto(digest, comprimir)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp_path = f"{ruta}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zstandard.ZstdCompressor(level=NIVEL_ZSTD).compress(datos) if comprimir else datos)
+        # Solo lectura: protege los objetos enlazados desde parts/ de escrituras accidentales
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, ruta)
+    else:
+        # Se refresca la fecha para que el GC no lo considere huérfano antiguo
+        os.utime(ruta)
+    return digest, ruta, os.path.getsize(ruta)
+
+
+def _leer_objeto(digest: str) -> bytes:
+    ruta = _buscar_objeto(digest)
+    if ruta is None:
+        raise FileNotFoundError(f"Artefacto {digest} no encontrado en {OBJETOS_DIR}")
+    with open(ruta, "rb") as f:
+        datos = f.read()
+    return zstandard.ZstdDecompressor().decompress(datos) if ruta.endswith(".zst") else datos
+
+
+def guardar_artefacto(contenido: Optional[str], tipo: str, resumen: Optional[str] = None,
+                      run_id: Optional[str] = None) -> Optional[dict]:
+    """
+    Guarda un texto en el almacén (si no existía ya) y devuelve su referencia:
+    {'id': sha256, 'tipo': str, 'bytes': int, 'resumen': str}. Devuelve None si no hay contenido.
+    Con run_id, el artefacto se registra en el manifiesto de la ejecución en el momento de crearlo.
+    """
+    if contenido is None:
+        return None
+    datos = contenido.encode("utf-8")
+    digest, _, bytes_almacenados = _guardar_objeto(datos, comprimir=True)
+    if run_id:
+        registrar_en_manifiesto(run_id, [{"sha256": digest, "nombre": f"artefacto/{tipo}", "tipo": tipo,
+                                          "bytes": len(datos), "bytes_almacenados": bytes_almacenados}])
+    return {
+        "id": digest,
+        "tipo": tipo,
+        "bytes": len(datos),
+        "resumen": resumir(contenido) if resumen is None else resumen,
+    }
+
+
+def cargar_artefacto(ref: Optional[dict]) -> Optional[str]:
+    """Devuelve el texto de una referencia (o de un id), o None si la referencia es None."""
+    if not ref:
+        return None
+    digest = ref["id"] if isinstance(ref, dict) else ref
+    return _leer_objeto(digest).decode("utf-8")
+
+
+# --- Manifiestos por ejecución ---
+
+def _abrir_manifiesto(run_id: str) -> sqlite3.Connection:
+    os.makedirs(MANIFIESTOS_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(MANIFIESTOS_DIR, f"{run_id}.sqlite"))
+    conn.execute("CREATE TABLE IF NOT EXISTS run (clave TEXT PRIMARY KEY, valor TEXT)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS artefactos ("
+        " sha256 TEXT NOT NULL, nombre TEXT NOT NULL, tipo TEXT, bytes INTEGER,"
+        " bytes_almacenados INTEGER, creado REAL, PRIMARY KEY (sha256, nombre))"
+    )
+    return conn
+
+
+def registrar_en_manifiesto(run_id: str, entradas: list, metadatos: Optional[dict] = None) -> None:
+    """
+    Añade al manifiesto de la ejecución las entradas (dicts con 'sha256', 'nombre', 'tipo',
+    'bytes' y 'bytes_almacenados') y los metadatos de la ejecución. Un manifiesto nuevo queda
+    'en_curso' hasta que los metadatos fijen otro 'estado'.
+    """
+    conn = _abrir_manifiesto(run_id)
+    with conn:
+        ahora = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO artefactos VALUES (?, ?, ?, ?, ?, ?)",
+            [(e["sha256"], e["nombre"], e.get("tipo"), e.get("bytes"), e.get("bytes_almacenados"), ahora) for e in entradas]
+        )
+        conn.execute("INSERT OR IGNORE INTO run VALUES ('estado', ?)", (ESTADO_EN_CURSO,))
+        for clave, valor in {**(metadatos or {}), "actualizado": str(ahora)}.items():
+            conn.execute("INSERT OR REPLACE INTO run VALUES (?, ?)", (clave, str(valor)))
+    conn.close()
+
+
+def guardar_archivo(ruta: str, enlazar: bool = True) -> dict:
+    """
+    Guarda un archivo en el almacén. Los formatos ya comprimidos (PNG...) se guardan tal cual y,
+    si enlazar es True, el archivo original se sustituye por un enlace duro al objeto, de modo que
+    las salidas idénticas de distintas iteraciones o piezas ocupan el disco una sola vez.
+    Devuelve la entrada de manifiesto correspondiente.
+    """
+    with open(ruta, "rb") as f:
+        datos = f.read()
+    comprimir = not ruta.lower().endswith(EXTENSIONES_SIN_COMPRESION)
+    digest, ruta_objeto, bytes_almacenados = _guardar_objeto(datos, comprimir)
+    # Solo se enlazan los formatos binarios: .py y .step se reescriben en cada iteración
+    if enlazar and not comprimir and not os.path.samefile(ruta, ruta_objeto):
+        tmp_path = f"{ruta}.{os.getpid()}.lnk"
+        try:
+            os.link(ruta_objeto, tmp_path)
+            os.replace(tmp_path, ruta)
+        except OSError:
+            # Sistemas de archivos distintos o sin enlaces duros: se conserva la copia
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return {
+        "sha256": digest,
+        "nombre": ruta.replace("\\", "/"),
+        "tipo": os.path.splitext(ruta)[1].lstrip(".").lower() or "archivo",
+        "bytes": len(datos),
+        "bytes_almacenados": bytes_almacenados,
+    }
+
+
+def archivar_parts(nombre_pieza: str, conservar: set, subpiezas: Optional[list] = None,
+                   parts_dir: str = "parts") -> list:
+    """
+    Guarda en el almacén todos los archivos de parts/<nombre_pieza>/ y de los directorios de sus
+    subpiezas, y elimina los que no están en conservar (las subpiezas conservan su .py y su .step,
+    que importa el script de ensamblaje). Sin la lista de subpiezas se toman los directorios
+    parts/<nombre_pieza>__<n>/. Devuelve las entradas de manifiesto.
+    """
+    if subpiezas is None:
+        subpiezas = []
+        if os.path.isdir(parts_dir):
+            patron = re.compile(re.escape(nombre_pieza) + r"__\d+")
+            subpiezas = sorted(e.name for e in os.scandir(parts_dir) if e.is_dir() and patron.fullmatch(e.name))
+    directorios = [(nombre_pieza, conservar)] + [(s, {f"{s}.py", f"{s}.step"}) for s in subpiezas]
+    entradas = []
+    for nombre_dir, conservar_dir in directorios:
+        dir_path = os.path.join(parts_dir, nombre_dir)
+        if not os.path.isdir(dir_path):
+            continue
+        for entrada in os.scandir(dir_path):
+            if not entrada.is_file():
+                continue
+            try:
+                entradas.append(guardar_archivo(entrada.path))
+                # Las salidas obsoletas (otros nombres de .step, restos de iteraciones) quedan solo en el almacén
+                if entrada.name not in conservar_dir:
+                    os.remove(entrada.path)
+            except Exception as e:
+                print(f"Error al archivar {entrada.path}: {e}")
+    return entradas
+
+
+def cerrar_ejecucion(run_id: str, estado: str, nombre_pieza: Optional[str] = None,
+                     metadatos: Optional[dict] = None) -> int:
+    """
+    Cierra el manifiesto de una ejecución que no ha terminado bien ('fallida', 'abandonada'):
+    archiva parts/<nombre_pieza>/ (conservando solo el último .py y .step) para que el GC y
+    limpiar_parts apliquen la misma retención que a las ejecuciones correctas.
+    Devuelve el número de archivos archivados.
+    """
+    entradas = archivar_parts(nombre_pieza, {f"{nombre_pieza}.py", f"{nombre_pieza}.step"}) if nombre_pieza else []
+    registrar_en_manifiesto(run_id, entradas, {**(metadatos or {}), "estado": estado})
+    return len(entradas)
+
+
+def restaurar_archivo(digest: str, destino: str) -> str:
+    """Escribe en destino el contenido original de un artefacto."""
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    with open(destino, "wb") as f:
+        f.write(_leer_objeto(digest))
+    return destino
+
+
+# --- Recolección de basura ---
+
+def _manifiestos() -> list:
+    """[(run_id, ruta, fecha de última actualización)] de más antiguo a más reciente."""
+    if not os.path.isdir(MANIFIESTOS_DIR):
+        return []
+    manifiestos = []
+    for nombre in os.listdir(MANIFIESTOS_DIR):
+        if nombre.endswith(".sqlite"):
+            ruta = os.path.join(MANIFIESTOS_DIR, nombre)
+            manifiestos.append((nombre[:-len(".sqlite")], ruta, os.path.getmtime(ruta)))
+    return sorted(manifiestos, key=lambda m: m[2])
+
+
+def _referencias(ruta_manifiesto: str) -> set:
+    conn = sqlite3.connect(ruta_manifiesto)
+    try:
+        return {fila[0] for fila in conn.execute("SELECT sha256 FROM artefactos")}
+    finally:
+        conn.close()
+
+
+def _metadatos(ruta_manifiesto: str) -> dict:
+    conn = sqlite3.connect(ruta_manifiesto)
+    try:
+        metadatos = dict(conn.execute("SELECT clave, valor FROM run"))
+    finally:
+        conn.close()
+    # Los manifiestos anteriores a los estados solo se escribían al terminar bien
+    metadatos.setdefault("estado", "ok")
+    return metadatos
+
+
+def _objetos() -> dict:
+    """{sha256: (ruta, bytes en disco, mtime)} de todos los objetos del almacén."""
+    objetos = {}
+    if not os.path.isdir(OBJETOS_DIR):
+        return objetos
+    for prefijo in os.listdir(OBJETOS_DIR):
+        directorio = os.path.join(OBJETOS_DIR, prefijo)
+        for entrada in os.scandir(directorio):
+            if entrada.name.endswith(".tmp"):
+                continue
+            estado = entrada.stat()
+            objetos[entrada.name.split(".")[0]] = (entrada.path, estado.st_size, estado.st_mtime)
+    return objetos
+
+
+def gc(max_bytes: Optional[int] = None, max_edad_dias: Optional[float] = None,
+       gracia_horas: float = 24.0, abandono_dias: Optional[float] = None, dry_run: bool = False) -> dict:
+    """
+    Aplica la política de retención:
+      0. Cierra como 'abandonada' (archivando su parts/) cada ejecución en curso sin actividad en
+         abandono_dias; el resto de ejecuciones en curso se conserva siempre.
+      1. Elimina los manifiestos de ejecuciones cerradas más antiguas que max_edad_dias.
+      2. Si el almacén ocupa más de max_bytes, elimina manifiestos cerrados de los más antiguos a
+         los más recientes hasta que lo referenciado quepa.
+      3. Borra los objetos que ya no referencia ningún manifiesto y que tienen más de
+         gracia_horas (los más recientes pueden pertenecer a ejecuciones que aún no los han registrado).
+    Devuelve un resumen con lo eliminado.
+    """
+    ahora = time.time()
+    abandonadas = []
+    for run_id, ruta, mtime in _manifiestos():
+        metadatos = _metadatos(ruta)
+        if metadatos["estado"] == ESTADO_EN_CURSO and abandono_dias is not None and ahora - mtime > abandono_dias * 86400:
+            abandonadas.append(run_id)
+            if not dry_run:
+                cerrar_ejecucion(run_id, "abandonada", metadatos.get("nombre_pieza"))
+    manifiestos = _manifiestos()
+    en_curso = [m for m in manifiestos if _metadatos(m[1])["estado"] == ESTADO_EN_CURSO]
+    cerrados = [m for m in manifiestos if m not in en_curso]
+    objetos = _objetos()
+    eliminar = []
+    if max_edad_dias is not None:
+        eliminar = [m for m in cerrados if ahora - m[2] > max_edad_dias * 86400]
+    conservados = [m for m in cerrados if m not in eliminar]
+    referencias = {m[0]: _referencias(m[1]) for m in conservados + en_curso}
+
+    def bytes_referenciados():
+        vivos = set().union(*referencias.values()) if referencias else set()
+        return sum(objetos[d][1] for d in vivos if d in objetos)
+
+    if max_bytes is not None:
+        while conservados and bytes_referenciados() > max_bytes:
+            m = conservados.pop(0)
+            eliminar.append(m)
+            del referencias[m[0]]
+
+    vivos = set().union(*referencias.values()) if referencias else set()
+    huerfanos = [d for d, (_, _, mtime) in objetos.items()
+                 if d not in vivos and ahora - mtime > gracia_horas * 3600]
+    bytes_liberados = sum(objetos[d][1] for d in huerfanos)
+    if not dry_run:
+        for _, ruta, _ in eliminar:
+            os.remove(ruta)
+        for d in huerfanos:
+            os.remove(objetos[d][0])
+    return {
+        "ejecuciones_abandonadas": abandonadas,
+        "manifiestos_eliminados": [m[0] for m in eliminar],
+        "objetos_eliminados": len(huerfanos),
+        "bytes_liberados": bytes_liberados,
+        "bytes_restantes": sum(o[1] for o in objetos.values()) - bytes_liberados,
+    }
+
+
+def limpiar_parts(max_edad_dias: float, parts_dir: str = "parts", dry_run: bool = False) -> list:
+    """Elimina las carpetas parts/<nombre_pieza>/ sin cambios en max_edad_dias (su contenido queda en el almacén)."""
+    eliminadas = []
+    if not os.path.isdir(parts_dir):
+        return eliminadas
+    ahora = time.time()
+    for entrada in os.scandir(parts_dir):
+        if not entrada.is_dir():
+            continue
+        ultima = max([e.stat().st_mtime for e in os.scandir(entrada.path)] or [entrada.stat().st_mtime])
+        if ahora - ultima > max_edad_dias * 86400:
+            eliminadas.append(entrada.path)
+            if not dry_run:
+                for e in os.scandir(entrada.path):
+                    os.remove(e.path)
+                os.rmdir(entrada.path)
+    return eliminadas
+
+
+def _parse_bytes(texto: str) -> int:
+    unidades = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    texto = texto.strip().upper().rstrip("B")
+    if texto and texto[-1] in unidades:
+        return int(float(texto[:-1]) * unidades[texto[-1]])
+    return int(texto)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Almacén de artefactos: estadísticas y recolección de basura.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("stats", help="Tamaño del almacén y número de ejecuciones")
+    p_gc = sub.add_parser("gc", help="Aplica la política de retención")
+    p_gc.add_argument("--max-bytes", type=_parse_bytes, default=None, help="Tamaño máximo del almacén (p. ej. 5G)")
+    p_gc.add_argument("--max-edad-dias", type=float, default=None, help="Antigüedad máxima de las ejecuciones")
+    p_gc.add_argument("--gracia-horas", type=float, default=24.0, help="Edad mínima de un objeto huérfano para borrarlo")
+    p_gc.add_argument("--abandono-dias", type=float, default=7.0, help="Inactividad tras la que una ejecución en curso se da por abandonada")
+    p_gc.add_argument("--parts-max-edad-dias", type=float, default=None, help="Elimina carpetas de parts/ inactivas")
+    p_gc.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.comando == "stats":
+        objetos = _objetos()
+        print(f"Objetos: {len(objetos)} ({sum(o[1] for o in objetos.values()) / 1024 ** 2:.1f} MiB), "
+              f"ejecuciones: {len(_manifiestos())}")
+        sys.exit(0)
+
+    resultado = gc(args.max_bytes, args.max_edad_dias, args.gracia_horas, args.abandono_dias, args.dry_run)
+    if args.parts_max_edad_dias is not None:
+        resultado["parts_eliminadas"] = limpiar_parts(args.parts_max_edad_dias, dry_run=args.dry_run)
+    print(resultado)
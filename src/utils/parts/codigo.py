@@ -2,7 +2,9 @@ import re
 import os # Necesario para os.path y para el código que se inyectará
 import importlib.util
 import traceback
-from openai import OpenAI
+from src.utils.parts.modelos import completar
+from src.utils.parts.ejemplos import buscar_ejemplos, estimar_tokens, MARCADOR_NOMBRE_PIEZA
+from src.utils.parts.errores import buscar_reparacion_local, registrar_consulta_llm, resumen_estadisticas
 # Patrón para extraer contenido de bloques de código delimitados por ```
 # ADVERTENCIA: Este patrón BACKTICK_PATTERN tal como está (r"(?:^|\n)``````
 # correctamente para extraer bloques de código Markdown. Debería ser algo como r"```(.*?)```
@@ -10,6 +12,13 @@ from openai import OpenAI
 # Se utiliza el patrón exacto que proporcionaste.
 BACKTICK_PATTERN = r"(?:^|\n)```(?:[a-zA-Z]+\n)?(.*?)```"
 
+# Ejemplos few-shot recuperados del índice local de piezas verificadas
+FEW_SHOT_K = 3
+FEW_SHOT_PRESUPUESTO_TOKENS = 1500
+# Presupuesto del contexto de iteración de feedforward (preguntas fallidas, feedback e historial)
+FEEDFORWARD_PRESUPUESTO_TOKENS = 1200
+
+
 def extract_code_from_response(content: str, nombre_pieza: str) -> str:
     """
     Extrae bloques de código, modifica las llamadas a cq.exporters.export para archivos .step
@@ -58,10 +67,10 @@ def extract_code_from_response(content: str, nombre_pieza: str) -> str:
 
     combined_code = "\n\n".join(processed_blocks)
 
-    if any_export_modified_to_parts:
-        create_dir_code_lines = []
-        if not re.search(r"^\s*import\s+os\b", combined_code, re.MULTILINE):
-            create_dir_code_lines.append("import os")
+    # Solo se añade el bloque de creación de directorios si no viene ya de una iteración anterior
+    if any_export_modified_to_parts and "os.makedirs('parts', exist_ok=True)" not in combined_code:
+        # El bloque va antes del código, así que necesita su propio import aunque el código ya importe os
+        create_dir_code_lines = ["import os"]
         # Corrección sintáctica aquí: usar comillas dobles externas para la cadena
         create_dir_code_lines.append("os.makedirs('parts', exist_ok=True)")
         setup_code = "\n".join(create_dir_code_lines)
@@ -115,25 +124,20 @@ def execute_cadquery_script(nombre_pieza: str, nombre_archivo_step: str = None)
     return result
 
 
-def repair_cadquery_code(code_with_error: str, error_message: str, max_attempts: int = 3, temperature: float = 0.2) -> str:
+def repair_cadquery_code(code_with_error: str, error_message: str, max_attempts: int = 3, temperature: float = 0.2, nivel: int = 0) -> tuple:
     """
-    Utiliza GPT para reparar código CadQuery que ha fallado, guiado por el mensaje de error.
+    Utiliza el modelo de la etapa 'reparador' para reparar código CadQuery que ha fallado, guiado por el mensaje de error.
     
     Parámetros:
       - code_with_error: El código fuente original que ha fallado.
       - error_message: El mensaje de error capturado en la ejecución.
       - max_attempts: Número máximo de intentos de reparación (por si lo llamas en bucle).
       - temperature: Creatividad de la respuesta del modelo.
+      - nivel: Nivel de escalado de modelo (número de reparaciones del LLM fallidas seguidas).
       
     Retorna:
-      - Código reparado como string.
+      - (código reparado como string, modelo usado). El éxito se anota al ejecutarlo.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY no está configurada en el entorno.")
-
-    client = OpenAI(api_key=api_key)
-
     system_prompt = (
         "Eres un asistente experto en Python y CadQuery. "
         "Te proporcionaré código que genera modelos 3D con CadQuery y un mensaje de error que se produjo al ejecutarlo. "
@@ -151,16 +155,173 @@ def repair_cadquery_code(code_with_error: str, error_message: str, max_attempts:
         "Por favor, corrige únicamente la causa de este error."
     )
 
-    # Llamada al modelo
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
+    # Llamada al modelo; si la respuesta no contiene código CadQuery se escala de modelo
+    fixed_code, modelo = completar(
+        "reparador",
+        [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
+        nivel=nivel,
+        validar=lambda c: bool(c) and ("cq." in c or "cadquery" in c),
+        diferido=True,
         temperature=temperature,
         max_tokens=1500
     )
-    # Asumimos que devuelve solo el bloque de código limpio
-    fixed_code = response.choices[0].message.content
-    return fixed_code.strip()
+    fixed_code = fixed_code.strip()
+    # extract_code_from_response necesita el bloque delimitado por ```
+    if "```" not in fixed_code:
+        fixed_code = f"```python\n{fixed_code}\n```"
+    return fixed_code, modelo
+
+
+def generate_cadquery_code(prompt: str, nombre_pieza: str) -> tuple:
+    """
+    Pide al modelo de la etapa 'generar_pieza' un script CadQuery que exporte '{nombre_pieza}.step',
+    con las piezas verificadas más parecidas como ejemplos few-shot.
+
+    Retorna:
+      - (respuesta del modelo con el bloque de código, modelo usado, número de ejemplos few-shot).
+    """
+    nombre_step = f"{nombre_pieza or 'mi_pieza'}.step"
+    system_prompt = (
+        "Eres un asistente experto en diseño mecánico y modelado 3D con CadQuery. "
+        "Cuando recibas una descripción en lenguaje natural de una pieza, "
+        "responde con un solo bloque de código Python que utilice CadQuery para generar la pieza, "
+        f"y añade una línea que exporte el modelo a formato .step con el nombre '{nombre_step}'. "
+        "No incluyas explicaciones ni texto fuera del bloque de código. "
+        "Ejemplo:\n"
+        "```python\n"
+        "import cadquery as cq\n"
+        "# ...código...\n"
+        f"cq.exporters.export(pieza_final, '{nombre_step}')\n"
+        "```"
+    )
+
+    # Piezas parecidas ya verificadas, como pares usuario/asistente antes del prompt real
+    ejemplos = buscar_ejemplos(prompt, k=FEW_SHOT_K, presupuesto_tokens=FEW_SHOT_PRESUPUESTO_TOKENS)
+    if ejemplos:
+        print(f"    {len(ejemplos)} ejemplos few-shot recuperados (similitud: {[e['similitud'] for e in ejemplos]})")
+    messages = [{"role": "system", "content": system_prompt}]
+    for ejemplo in ejemplos:
+        messages.append({"role": "user", "content": ejemplo["prompt"]})
+        codigo_ejemplo = ejemplo['codigo'].replace(MARCADOR_NOMBRE_PIEZA, nombre_pieza or 'mi_pieza')
+        messages.append({"role": "assistant", "content": f"```python\n{codigo_ejemplo}\n```"})
+    messages.append({"role": "user", "content": prompt})
+
+    contenido, modelo = completar(
+        "generar_pieza",
+        messages,
+        validar=lambda c: bool(c) and "```" in c,
+        temperature=0.1,
+        max_tokens=900
+    )
+    return contenido, modelo, len(ejemplos)
+
+
+def reparar_codigo(codigo_fallido: str, mensaje_error: str, pendiente: dict = None) -> dict:
+    """
+    Elige la siguiente reparación de un código que ha fallado: primero la reparación local
+    (base de errores y reglas) y, si la anterior ya fue local o no hay ninguna, el LLM.
+    Cada reparación del LLM que vuelve a fallar escala al siguiente modelo de la ruta.
+
+    Parámetros:
+      - pendiente: la reparación anterior de este mismo código ({'origen', 'nivel', ...}) o None.
+
+    Retorna:
+      - dict con 'codigo' (respuesta con el bloque ```), 'origen' ('llm', 'kb:...' o 'regla:...'),
+        'modelo' (None si fue local) y 'nivel'.
+    """
+    pendiente = pendiente or {}
+    if pendiente.get('origen', 'llm') == 'llm':
+        codigo_local, origen = buscar_reparacion_local(codigo_fallido, mensaje_error)
+        if codigo_local:
+            print(f"Reparación local aplicada ({origen}), sin llamada al LLM.")
+            print(resumen_estadisticas())
+            return {'codigo': f"```python\n{codigo_local}\n```", 'origen': origen, 'modelo': None,
+                    'nivel': pendiente.get('nivel', 0)}
+
+    nivel = pendiente.get('nivel', -1) + 1 if pendiente.get('origen') == 'llm' else pendiente.get('nivel', 0)
+    print(f"Llamando a LLM para intentar reparar el código CadQuery (nivel {nivel})...")
+    codigo_reparado, modelo = repair_cadquery_code(codigo_fallido, mensaje_error, nivel=nivel)
+    # Se anota al volver del LLM: en modo lote la llamada puede suspender el grafo y el nodo se repite al reanudar
+    registrar_consulta_llm(mensaje_error)
+    print(resumen_estadisticas())
+    return {'codigo': codigo_reparado, 'origen': 'llm', 'modelo': modelo, 'nivel': nivel}
+
+
+def _recortar_a_tokens(texto: str, tokens: int) -> str:
+    if estimar_tokens(texto) <= tokens:
+        return texto
+    return texto[:max(tokens - 1, 0) * 4].rstrip() + "..."
+
+
+def condensar_contexto_iteracion(fallidas: list, feedback: str, historial: list,
+                                 presupuesto_tokens: int = FEEDFORWARD_PRESUPUESTO_TOKENS) -> str:
+    """
+    Resume lo que ha fallado en la verificación dentro de un presupuesto fijo de tokens, para que
+    el prompt de feedforward no crezca con las iteraciones:
+      - preguntas de verificación que fallan (hasta 1/4 del presupuesto),
+      - feedback accionable (hasta 2/3 de lo que quede),
+      - intentos anteriores del historial, del más reciente al más antiguo, mientras quepan.
+    """
+    secciones = []
+    restante = presupuesto_tokens
+    if fallidas:
+        texto = _recortar_a_tokens("Preguntas de verificación que fallan:\n" + "\n".join(f"- {q}" for q in fallidas),
+                                   presupuesto_tokens // 4)
+        secciones.append(texto)
+        restante -= estimar_tokens(texto)
+    if feedback and feedback.strip():
+        texto = _recortar_a_tokens("Correcciones sugeridas:\n" + feedback.strip(), restante * 2 // 3)
+        secciones.append(texto)
+        restante -= estimar_tokens(texto)
+    lineas = []
+    for paso in reversed(historial or []):
+        linea = f"- #{paso.get('n')} {paso.get('etapa')}: {paso.get('resultado')} ({paso.get('resumen', '')})"
+        if estimar_tokens(linea) > restante:
+            break
+        lineas.append(linea)
+        restante -= estimar_tokens(linea)
+    if lineas:
+        secciones.append("Intentos anteriores (del más reciente al más antiguo):\n" + "\n".join(lineas))
+    return "\n\n".join(secciones)
+
+
+def refine_cadquery_code(prompt: str, codigo_previo: str, contexto: str, nombre_pieza: str, nivel: int = 0) -> tuple:
+    """
+    Regenera la pieza a partir del código anterior (que se ejecuta pero no supera la verificación)
+    y del contexto de iteración condensado, con el modelo de la etapa 'feedforward'.
+
+    Parámetros:
+      - contexto: salida de condensar_contexto_iteracion.
+      - nivel: nivel de escalado de modelo (número de regeneraciones anteriores en la ejecución).
+
+    Retorna:
+      - (respuesta del modelo con el bloque de código, modelo usado).
+    """
+    nombre_step = f"{nombre_pieza or 'mi_pieza'}.step"
+    system_prompt = (
+        "Eres un asistente experto en diseño mecánico y modelado 3D con CadQuery. "
+        "Recibirás la descripción de una pieza, el código CadQuery actual, que se ejecuta pero no cumple la descripción, "
+        "y las preguntas de verificación que fallan junto con las correcciones sugeridas. "
+        "Modifica el código para que todas las preguntas se respondan 'Yes' sin cambiar lo que ya es correcto. "
+        f"Responde con un solo bloque de código Python completo que exporte el modelo a '{nombre_step}', "
+        "sin explicaciones fuera del bloque de código."
+    )
+    user_prompt = (
+        f"Descripción de la pieza:\n{prompt}\n\n"
+        f"Código actual:\n```python\n{codigo_previo}\n```\n\n"
+        f"{contexto}"
+    )
+    return completar(
+        "feedforward",
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        nivel=nivel,
+        validar=lambda c: bool(c) and "```" in c,
+        temperature=0.2,
+        max_tokens=1500
+    )
@@ -0,0 +1,104 @@
+import re
+import json
+from src.utils.parts.modelos import completar
+
+# Descomposición opcional de una pieza compleja en subpiezas independientes. Cada subpieza se
+# genera y ejecuta por separado (en paralelo) y un script de ensamblaje determinista las combina.
+MAX_SUBPIEZAS = 6
+# Reparaciones por subpieza antes de darla por fallida (se reparan aisladas, sin volver al grafo)
+MAX_REPARACIONES_SUBPIEZA = 3
+OPERACIONES = ("union", "corte")
+
+
+def _validar_plan(contenido: str):
+    """Devuelve la lista de subpiezas normalizada o None si la respuesta no es un plan válido."""
+    try:
+        datos = json.loads(contenido or "")
+    except json.JSONDecodeError:
+        return None
+    subpiezas = datos.get("subpiezas") if isinstance(datos, dict) else datos
+    if not isinstance(subpiezas, list) or not subpiezas:
+        return None
+    plan = []
+    for i, sub in enumerate(subpiezas[:MAX_SUBPIEZAS]):
+        if not isinstance(sub, dict) or not str(sub.get("descripcion") or "").strip():
+            return None
+        posicion = sub.get("posicion") or [0, 0, 0]
+        try:
+            posicion = [float(v) for v in posicion][:3] + [0.0] * (3 - len(posicion[:3]))
+        except (TypeError, ValueError):
+            return None
+        operacion = sub.get("operacion") if sub.get("operacion") in OPERACIONES else "union"
+        plan.append({
+            "nombre": re.sub(r"\W+", "_", str(sub.get("nombre") or "")).strip("_") or f"subpieza_{i}",
+            "descripcion": str(sub["descripcion"]).strip(),
+            "posicion": posicion,
+            # La primera subpieza es el cuerpo base: no se puede restar de la nada
+            "operacion": "union" if i == 0 else operacion,
+        })
+    return plan
+
+
+def descomponer_prompt(prompt: str) -> list:
+    """
+    Pide al modelo de la etapa 'descomponer' que divida la descripción de una pieza en subpiezas
+    geométricas independientes, cada una colocada en la pieza final por el centro de su caja envolvente.
+
+    Retorna:
+      - Lista de {'nombre', 'descripcion', 'posicion': [x, y, z], 'operacion': 'union' | 'corte'};
+        una sola subpieza (o ninguna, si la respuesta no es válida) indica que no merece la pena descomponer.
+    """
+    system_prompt = (
+        "Eres un ingeniero de diseño mecánico. Divide la descripción de una pieza en subcomponentes geométricos "
+        "independientes que se puedan modelar por separado con CadQuery y combinar después con operaciones booleanas. "
+        "Responde solo con JSON con la forma "
+        '{"subpiezas": [{"nombre": "snake_case", "descripcion": "...", "posicion": [x, y, z], "operacion": "union"}]}.\n'
+        "Reglas:\n"
+        "(1) Cada descripción debe ser autocontenida, con todas sus medidas, y describir la subpieza centrada en el origen.\n"
+        "(2) 'posicion' es el punto (en las mismas unidades) de la pieza final donde queda el centro de la subpieza.\n"
+        "(3) 'operacion' es 'union' para añadir material o 'corte' para restarlo (agujeros, ranuras, vaciados).\n"
+        "(4) La primera subpieza es el cuerpo base.\n"
+        f"(5) Como máximo {MAX_SUBPIEZAS} subpiezas. Si la pieza es simple, devuelve una sola subpieza con la descripción original."
+    )
+    contenido, modelo = completar(
+        "descomponer",
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        validar=lambda c: _validar_plan(c) is not None,
+        temperature=0.0,
+        max_tokens=800,
+        response_format={"type": "json_object"}
+    )
+    print(f"    Plan de descomposición ({modelo}): {contenido}")
+    return _validar_plan(contenido) or []
+
+
+def generar_codigo_ensamblaje(nombre_pieza: str, subpiezas: list) -> str:
+    """
+    Genera (sin LLM) el script CadQuery que importa el .step de cada subpieza, la centra sobre
+    su caja envolvente, la traslada a su posición, la une o la resta en orden y exporta el
+    resultado a parts/<nombre_pieza>/<nombre_pieza>.step. La primera subpieza de la lista es el cuerpo base.
+    Se centra en el script porque ni las plantillas (cilindro y brida con z en [0, h], escuadra desde
+    una esquina) ni el código del LLM garantizan que la subpieza esté centrada en el origen.
+    """
+    lineas = [
+        "import os", "os.makedirs('parts', exist_ok=True)", "", "import cadquery as cq", "",
+        "def colocar(solido, posicion):",
+        "    centro = solido.val().BoundingBox().center",
+        "    return solido.translate((posicion[0] - centro.x, posicion[1] - centro.y, posicion[2] - centro.z))",
+        "",
+    ]
+    for i, sub in enumerate(subpiezas):
+        x, y, z = sub["posicion"]
+        step = f"parts/{sub['nombre_pieza']}/{sub['nombre_pieza']}.step"
+        lineas.append(f"# Subpieza {sub['indice']} '{sub['nombre']}' ({sub['operacion']})")
+        lineas.append(f"sub_{i} = colocar(cq.importers.importStep('{step}'), ({x}, {y}, {z}))")
+        if i == 0:
+            lineas.append(f"result = sub_{i}")
+        else:
+            lineas.append(f"result = result.{'cut' if sub['operacion'] == 'corte' else 'union'}(sub_{i})")
+    lineas.append("")
+    lineas.append(f"cq.exporters.export(result, 'parts/{nombre_pieza}/{nombre_pieza}.step')")
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,118 @@
+import os
+import re
+import math
+import time
+import unicodedata
+from collections import Counter
+from src.utils.parts.kb import KB_DIR, cargar_json, guardar_json
+
+# Índice local (TF-IDF, sin red) de piezas verificadas en ejecuciones anteriores.
+# Cada documento guarda el prompt de entrada, el código final y los veredictos de la
+# verificación; generar_pieza recupera los más parecidos como ejemplos few-shot.
+KB_EJEMPLOS_PATH = os.path.join(KB_DIR, "ejemplos.json")
+
+MAX_DOCUMENTOS = 2000
+SIMILITUD_MINIMA = 0.1
+# Sustituye al nombre de la pieza original en el archivo .step que exporta el código guardado
+MARCADOR_NOMBRE_PIEZA = "__NOMBRE_PIEZA__"
+
+
+def _cargar_indice() -> dict:
+    return cargar_json(KB_EJEMPLOS_PATH, {"documentos": [], "df": {}})
+
+
+def _guardar_indice(indice: dict) -> None:
+    # Sin sangría: el índice puede tener miles de documentos
+    guardar_json(KB_EJEMPLOS_PATH, indice, indent=None)
+
+
+def _tokenizar(texto: str) -> list:
+    # Minúsculas sin acentos; los números se agrupan porque las dimensiones cambian entre piezas
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    palabras = re.findall(r"[a-z]+|\d+(?:[.,]\d+)?", texto)
+    return ["<num>" if p[0].isdigit() else p for p in palabras if len(p) > 2 or p[0].isdigit()]
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimación rápida de tokens (~4 caracteres por token)."""
+    return len(texto) // 4 + 1
+
+
+def _vector_tfidf(terminos: dict, df: dict, n_docs: int) -> dict:
+    # IDF suavizado (+1): los términos presentes en todos los documentos siguen contando, y con
+    # un único documento indexado la similitud no es siempre 0
+    vector = {t: (1 + math.log(tf)) * (math.log((1 + n_docs) / (1 + df.get(t, 0))) + 1) for t, tf in terminos.items()}
+    norma = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {t: v / norma for t, v in vector.items()}
+
+
+def registrar_ejemplo(prompt: str, codigo: str, veredictos: list, nombre_pieza: str = None) -> None:
+    """
+    Añade (o actualiza) una pieza verificada en el índice. La actualización es incremental:
+    solo se ajustan las frecuencias de documento de los términos del prompt.
+    """
+    if not prompt or not codigo:
+        return
+    # La ruta y el nombre del .step dependen de la pieza original: se guarda el nombre con un
+    # marcador que generate_cadquery_code sustituye por el de la pieza que se está generando
+    if nombre_pieza:
+        codigo = codigo.replace(f"parts/{nombre_pieza}/", "")
+        codigo = codigo.replace(f"{nombre_pieza}.step", f"{MARCADOR_NOMBRE_PIEZA}.step")
+    codigo = codigo.replace("os.makedirs('parts', exist_ok=True)", "").strip()
+    indice = _cargar_indice()
+    df = indice["df"]
+    documentos = indice["documentos"]
+
+    def quitar(doc):
+        for t in doc["terminos"]:
+            df[t] -= 1
+            if df[t] <= 0:
+                del df[t]
+
+    for doc in [d for d in documentos if d["prompt"] == prompt]:
+        quitar(doc)
+        documentos.remove(doc)
+    while len(documentos) >= MAX_DOCUMENTOS:
+        quitar(documentos.pop(0))
+
+    terminos = dict(Counter(_tokenizar(prompt)))
+    for t in terminos:
+        df[t] = df.get(t, 0) + 1
+    documentos.append({
+        "prompt": prompt,
+        "codigo": codigo,
+        "veredictos": veredictos,
+        "terminos": terminos,
+        "fecha": time.time(),
+    })
+    _guardar_indice(indice)
+
+
+def buscar_ejemplos(prompt: str, k: int = 3, presupuesto_tokens: int = 1500) -> list:
+    """
+    Devuelve hasta k ejemplos verificados más parecidos al prompt (similitud coseno TF-IDF),
+    sin superar el presupuesto de tokens entre prompt y código de todos los ejemplos.
+    """
+    indice = _cargar_indice()
+    documentos = indice["documentos"]
+    if not prompt or not documentos:
+        return []
+    n_docs = len(documentos)
+    consulta = _vector_tfidf(Counter(_tokenizar(prompt)), indice["df"], n_docs)
+    puntuados = []
+    for doc in documentos:
+        vector = _vector_tfidf(doc["terminos"], indice["df"], n_docs)
+        similitud = sum(v * vector.get(t, 0.0) for t, v in consulta.items())
+        if similitud >= SIMILITUD_MINIMA:
+            puntuados.append((similitud, doc))
+    puntuados.sort(key=lambda p: p[0], reverse=True)
+
+    ejemplos, usados = [], 0
+    for similitud, doc in puntuados[:k]:
+        coste = estimar_tokens(doc["prompt"]) + estimar_tokens(doc["codigo"])
+        if usados + coste > presupuesto_tokens:
+            continue
+        usados += coste
+        ejemplos.append({"prompt": doc["prompt"], "codigo": doc["codigo"], "similitud": round(similitud, 3)})
+    return ejemplos
@@ -0,0 +1,321 @@
+import os
+import re
+import difflib
+import hashlib
+import keyword
+import builtins
+import threading
+from src.utils.parts.kb import KB_DIR, cargar_json, guardar_json
+
+# Base de conocimiento local de errores de ejecución de CadQuery.
+# Cada traceback se normaliza en una firma estable (tipo de excepción, mensaje sin
+# números/rutas y operación de CadQuery que falló) y se indexa junto con las
+# reparaciones que, tras aplicarse, produjeron un .step válido.
+KB_ERRORES_PATH = os.path.join(KB_DIR, "errores.json")
+
+# Límite de reparaciones aprendidas que se guardan por firma
+MAX_REPARACIONES_POR_FIRMA = 5
+# Las reparaciones con demasiados cambios son reescrituras completas que no se reaplican bien
+MAX_LINEAS_POR_REPARACION = 40
+
+# Las subpiezas se reparan en paralelo: las escrituras de la base se serializan
+_lock = threading.Lock()
+
+
+def _cargar_kb() -> dict:
+    return cargar_json(KB_ERRORES_PATH, {"firmas": {}, "estadisticas": {"aciertos": 0, "fallos_locales": 0, "consultas_llm": 0}})
+
+
+def _guardar_kb(kb: dict) -> None:
+    guardar_json(KB_ERRORES_PATH, kb)
+
+
+def _normalizar_mensaje(mensaje: str) -> str:
+    mensaje = re.sub(r"0x[0-9a-fA-F]+", "0x?", mensaje)
+    mensaje = re.sub(r"(['\"])[^'\"]*\1", "'?'", mensaje)
+    mensaje = re.sub(r"(?:[\w.-]*[/\\])+[\w.-]+", "<ruta>", mensaje)
+    mensaje = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e-?\d+)?", "N", mensaje)
+    return re.sub(r"\s+", " ", mensaje).strip()
+
+
+def normalizar_error(mensaje_error: str) -> dict:
+    """
+    Convierte un traceback (o mensaje de error) de execute_cadquery_script en una firma estable.
+    Devuelve un dict con 'tipo', 'mensaje', 'operacion', 'firma' y 'clave' (hash corto de la firma).
+    """
+    lineas = [l for l in (mensaje_error or "").strip().splitlines() if l.strip()]
+    ultima = lineas[-1].strip() if lineas else ""
+    if ":" in ultima and re.match(r"^[\w.]+:", ultima):
+        tipo, mensaje = ultima.split(":", 1)
+    else:
+        tipo, mensaje = "Error", ultima
+    tipo = tipo.split(".")[-1]
+
+    # Operación: la función más profunda dentro de cadquery, o si no la última llamada del script
+    operacion = ""
+    frames = re.findall(r'File "([^"]+)", line \d+, in (\S+)', mensaje_error or "")
+    for ruta, funcion in frames:
+        if "cadquery" in ruta.replace("\\", "/"):
+            operacion = funcion
+    if not operacion:
+        for i, linea in enumerate(lineas):
+            if linea.strip().startswith('File "') and "site-packages" not in linea and i + 1 < len(lineas):
+                llamadas = re.findall(r"\.(\w+)\(", lineas[i + 1])
+                if llamadas:
+                    operacion = llamadas[-1]
+    if tipo == "Error" and "STEP no encontrado" in ultima:
+        operacion = "export"
+
+    mensaje = _normalizar_mensaje(mensaje)
+    firma = f"{tipo}: {mensaje} @{operacion or '?'}"
+    clave = hashlib.sha1(firma.encode("utf-8")).hexdigest()[:12]
+    return {"tipo": tipo, "mensaje": mensaje, "operacion": operacion, "firma": firma, "clave": clave}
+
+
+# --- Reglas deterministas para las clases de fallo más comunes ---
+
+def _regla_fillet_reducido(codigo: str, error: dict, mensaje_error: str):
+    # StdFail_NotDone en fillet/chamfer: casi siempre el radio es mayor que la arista
+    if "NotDone" not in error["tipo"] and "not done" not in mensaje_error.lower():
+        return None
+    if error["operacion"] not in ("fillet", "chamfer", "?", ""):
+        return None
+
+    def reducir(m):
+        return f".{m.group(1)}({float(m.group(2)) / 2:g}"
+
+    nuevo = re.sub(r"\.(fillet|chamfer)\(\s*(\d*\.?\d+)", reducir, codigo)
+    return nuevo if nuevo != codigo else None
+
+
+def _regla_show_object(codigo: str, error: dict, mensaje_error: str):
+    # show_object solo existe dentro de CQ-editor
+    if error["tipo"] != "NameError" or "show_object" not in mensaje_error:
+        return None
+    nuevo = re.sub(r"^(\s*)(show_object\(.*)$", r"\1pass  # \2", codigo, flags=re.MULTILINE)
+    return nuevo if nuevo != codigo else None
+
+
+def _regla_export_step_metodo(codigo: str, error: dict, mensaje_error: str):
+    # Workplane no tiene exportStep: se usa cq.exporters.export
+    if error["tipo"] != "AttributeError" or "exportStep" not in mensaje_error:
+        return None
+    nuevo = re.sub(r"^(\s*)([A-Za-z_]\w*)\.exportStep\((.+)\)\s*$",
+                   r"\1cq.exporters.export(\2, \3)", codigo, flags=re.MULTILINE)
+    return nuevo if nuevo != codigo else None
+
+
+def _regla_export_invertido(codigo: str, error: dict, mensaje_error: str):
+    # cq.exporters.export('archivo.step', pieza) -> cq.exporters.export(pieza, 'archivo.step')
+    if "export" not in mensaje_error:
+        return None
+    nuevo = re.sub(r"cq\.exporters\.export\(\s*(['\"][^'\"]+['\"])\s*,\s*([^,()]+?)\s*([,)])",
+                   r"cq.exporters.export(\2, \1\3", codigo)
+    return nuevo if nuevo != codigo else None
+
+
+def _regla_export_tipo(codigo: str, error: dict, mensaje_error: str):
+    # Los tipos de exportación de CadQuery van en mayúsculas ('STEP')
+    if "export" not in mensaje_error.lower() or "type" not in mensaje_error.lower():
+        return None
+    nuevo = re.sub(r"(cq\.exporters\.export\([^,]+,[^,]+,\s*(?:exportType\s*=\s*)?)(['\"])(\w+)\2",
+                   lambda m: f"{m.group(1)}{m.group(2)}{m.group(3).upper()}{m.group(2)}", codigo)
+    return nuevo if nuevo != codigo else None
+
+
+def _regla_step_no_encontrado(codigo: str, error: dict, mensaje_error: str):
+    # El script exportó con otro nombre (o no exportó): se fuerza la ruta que espera el flujo
+    m = re.search(r"Archivo STEP no encontrado en (\S+)", mensaje_error)
+    if not m:
+        return None
+    step_path = m.group(1).replace("\\", "/")
+    export_pattern = r"(cq\.exporters\.export\(\s*[^,]+,\s*)(['\"])[^'\"]*\2"
+    if re.search(export_pattern, codigo):
+        nuevo = re.sub(export_pattern, lambda e: f"{e.group(1)}'{step_path}'", codigo, count=1)
+        return nuevo if nuevo != codigo else None
+    asignaciones = re.findall(r"^([A-Za-z_]\w*)\s*=\s*", codigo, flags=re.MULTILINE)
+    if not asignaciones:
+        return None
+    return codigo.rstrip() + f"\ncq.exporters.export({asignaciones[-1]}, '{step_path}')\n"
+
+
+REGLAS = [
+    ("step_no_encontrado", _regla_step_no_encontrado),
+    ("show_object", _regla_show_object),
+    ("export_step_metodo", _regla_export_step_metodo),
+    ("export_invertido", _regla_export_invertido),
+    ("export_tipo", _regla_export_tipo),
+    ("fillet_reducido", _regla_fillet_reducido),
+]
+
+
+# --- Reparaciones aprendidas (parches de líneas verificados) ---
+
+def _calcular_parche(codigo_antes: str, codigo_despues: str) -> list:
+    antes = codigo_antes.splitlines()
+    despues = codigo_despues.splitlines()
+    parche = []
+    matcher = difflib.SequenceMatcher(a=antes, b=despues, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            continue
+        parche.append({
+            "ancla": antes[i1 - 1] if i1 > 0 else None,
+            "antes": antes[i1:i2],
+            "despues": despues[j1:j2],
+        })
+    return parche
+
+
+# Tokens de una línea de código al comparar parches: las cadenas se comparan tal cual; los números
+# y los nombres propios del script (variables) son comodines, para reaplicar un parche aprendido en
+# otra pieza con otras medidas u otros nombres de variable
+_TOKEN_PARCHE = re.compile(
+    r"""(?P<cadena>'[^']*'|"[^"]*")"""
+    r"|(?P<numero>(?<![\w.])\d+(?:\.\d+)?(?:[eE]-?\d+)?)"
+    r"|(?P<nombre>(?<![\w.])[A-Za-z_]\w*)"
+)
+# Nombres que forman parte de la API y no se sustituyen
+_NOMBRES_FIJOS = set(keyword.kwlist) | set(dir(builtins)) | {"cq", "cadquery", "os", "math"}
+
+
+def _es_comodin(m) -> bool:
+    return m.lastgroup == "numero" or (m.lastgroup == "nombre" and m.group() not in _NOMBRES_FIJOS)
+
+
+def _patron_linea(linea: str) -> tuple:
+    """(línea con los comodines sustituidos por N/V, lista de valores de los comodines)."""
+    valores = []
+
+    def sustituir(m):
+        if not _es_comodin(m):
+            return m.group()
+        valores.append(m.group())
+        return "N" if m.lastgroup == "numero" else "V"
+
+    return _TOKEN_PARCHE.sub(sustituir, linea.strip()), valores
+
+
+def _casar_lineas(guardadas: list, actuales: list, mapa: dict) -> bool:
+    """Compara líneas por su patrón y amplía mapa (valor del parche -> valor del código); False si no casan."""
+    nuevo = dict(mapa)
+    for guardada, actual in zip(guardadas, actuales):
+        patron_g, valores_g = _patron_linea(guardada)
+        patron_a, valores_a = _patron_linea(actual)
+        if patron_g != patron_a:
+            return False
+        for v_g, v_a in zip(valores_g, valores_a):
+            if nuevo.setdefault(v_g, v_a) != v_a:
+                return False
+    mapa.update(nuevo)
+    return True
+
+
+def _concretar_linea(linea: str, mapa: dict) -> str:
+    return _TOKEN_PARCHE.sub(lambda m: mapa.get(m.group(), m.group()) if _es_comodin(m) else m.group(), linea)
+
+
+def _aplicar_parche(codigo: str, parche: list):
+    lineas = codigo.splitlines()
+    for hunk in parche:
+        antes = hunk["antes"]
+        mapa = {}
+        pos = None
+        if antes:
+            for i in range(len(lineas) - len(antes) + 1):
+                if _casar_lineas(antes, lineas[i:i + len(antes)], mapa):
+                    pos = i
+                    break
+        elif hunk["ancla"] is None:
+            pos = 0
+        else:
+            for i, linea in enumerate(lineas):
+                if _casar_lineas([hunk["ancla"]], [linea], mapa):
+                    pos = i + 1
+                    break
+        if pos is None:
+            return None
+        lineas[pos:pos + len(antes)] = [_concretar_linea(l, mapa) for l in hunk["despues"]]
+    nuevo = "\n".join(lineas)
+    return nuevo if nuevo.strip() != codigo.strip() else None
+
+
+def buscar_reparacion_local(codigo: str, mensaje_error: str):
+    """
+    Intenta reparar el código sin llamar al LLM: primero con reparaciones aprendidas para la
+    misma firma de error, después con las reglas deterministas.
+    Devuelve (codigo_reparado, origen) o (None, None) si no hay reparación local aplicable.
+    """
+    error = normalizar_error(mensaje_error)
+    kb = _cargar_kb()
+    entrada = kb["firmas"].get(error["clave"])
+    if entrada:
+        ordenadas = sorted(enumerate(entrada["reparaciones"]),
+                           key=lambda r: r[1]["aciertos"] - r[1]["fallos"], reverse=True)
+        for indice, reparacion in ordenadas:
+            nuevo = _aplicar_parche(codigo, reparacion["parche"])
+            if nuevo:
+                return nuevo, f"kb:{error['clave']}:{indice}"
+    for nombre, regla in REGLAS:
+        nuevo = regla(codigo, error, mensaje_error or "")
+        if nuevo:
+            return nuevo, f"regla:{nombre}"
+    return None, None
+
+
+def registrar_consulta_llm(mensaje_error: str) -> None:
+    """Anota que una firma no tenía reparación local y se delegó al LLM."""
+    with _lock:
+        error = normalizar_error(mensaje_error)
+        kb = _cargar_kb()
+        entrada = kb["firmas"].setdefault(error["clave"], {"firma": error["firma"], "vistas": 0, "reparaciones": []})
+        entrada["vistas"] += 1
+        kb["estadisticas"]["consultas_llm"] += 1
+        _guardar_kb(kb)
+
+
+def registrar_resultado_reparacion(pendiente: dict, codigo_nuevo: str, ok: bool) -> None:
+    """
+    Actualiza la base de conocimiento con el resultado de ejecutar una reparación.
+      - pendiente: dict con 'error', 'codigo_fallido' y 'origen' ('llm', 'kb:<clave>:<i>' o 'regla:<nombre>').
+      - codigo_nuevo: código reparado que se acaba de ejecutar.
+      - ok: si la ejecución generó el .step.
+    Las reparaciones del LLM que funcionan se guardan como parche reaplicable para su firma.
+    """
+    with _lock:
+        error = normalizar_error(pendiente.get("error", ""))
+        origen = pendiente.get("origen", "llm")
+        kb = _cargar_kb()
+        estadisticas = kb["estadisticas"]
+        entrada = kb["firmas"].setdefault(error["clave"], {"firma": error["firma"], "vistas": 0, "reparaciones": []})
+
+        if origen.startswith("kb:"):
+            indice = int(origen.rsplit(":", 1)[1])
+            if indice < len(entrada["reparaciones"]):
+                entrada["reparaciones"][indice]["aciertos" if ok else "fallos"] += 1
+        if origen != "llm":
+            estadisticas["aciertos" if ok else "fallos_locales"] += 1
+        elif ok:
+            parche = _calcular_parche(pendiente.get("codigo_fallido", ""), codigo_nuevo)
+            n_lineas = sum(len(h["antes"]) + len(h["despues"]) for h in parche)
+            if parche and n_lineas <= MAX_LINEAS_POR_REPARACION and \
+                    all(r["parche"] != parche for r in entrada["reparaciones"]):
+                entrada["reparaciones"].append({"parche": parche, "aciertos": 0, "fallos": 0})
+                entrada["reparaciones"].sort(key=lambda r: r["aciertos"] - r["fallos"], reverse=True)
+                del entrada["reparaciones"][MAX_REPARACIONES_POR_FIRMA:]
+        _guardar_kb(kb)
+
+
+def resumen_estadisticas() -> str:
+    """Texto breve con aciertos/fallos de la reparación local."""
+    est = _cargar_kb()["estadisticas"]
+    total = est["aciertos"] + est["fallos_locales"] + est["consultas_llm"]
+    tasa = est["aciertos"] / total if total else 0.0
+    return (f"Reparación local: {est['aciertos']} aciertos, {est['fallos_locales']} fallos locales, "
+            f"{est['consultas_llm']} consultas al LLM (tasa de acierto {tasa:.0%})")
+
+
+if __name__ == "__main__":
+    print(resumen_estadisticas())
+    for clave, entrada in _cargar_kb()["firmas"].items():
+        print(f"  [{clave}] {entrada['firma']} - vistas: {entrada['vistas']}, reparaciones: {len(entrada['reparaciones'])}")
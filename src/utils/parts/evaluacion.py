@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.spatial import cKDTree
+from OCC.Extend.DataExchange import read_step_file
+from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+from OCC.Core.BRep import BRep_Tool
+from OCC.Core.TopExp import TopExp_Explorer
+from OCC.Core.TopAbs import TopAbs_FACE, TopAbs_REVERSED
+from OCC.Core.TopLoc import TopLoc_Location
+from OCC.Core.TopoDS import topods
+
+# Métricas geométricas sin LLM entre una pieza generada y una de referencia (.step):
+# distancias Chamfer/Hausdorff entre nubes de puntos muestreadas en la superficie teselada,
+# IoU sobre una rejilla de vóxeles y diferencias de volumen y área.
+# Ambas piezas se centran en el centro de su caja envolvente; la orientación no se alinea.
+
+
+def cargar_malla(step_path: str, deflexion_relativa: float = 0.002):
+    """
+    Tesela un .step y devuelve (vertices (N, 3), triangulos (M, 3)) como arrays de NumPy,
+    con los triángulos orientados hacia fuera. La deflexión es relativa a la diagonal de la pieza.
+    """
+    shape = read_step_file(step_path)
+    # Primera pasada gruesa solo para conocer el tamaño y fijar la deflexión
+    BRepMesh_IncrementalMesh(shape, 1.0, False, 0.5, True)
+    vertices, triangulos = _triangulacion(shape)
+    diagonal = np.linalg.norm(vertices.max(axis=0) - vertices.min(axis=0)) if len(vertices) else 1.0
+    BRepMesh_IncrementalMesh(shape, max(diagonal * deflexion_relativa, 1e-4), False, 0.5, True)
+    return _triangulacion(shape)
+
+
+def _triangulacion(shape):
+    vertices, triangulos, desplazamiento = [], [], 0
+    explorer = TopExp_Explorer(shape, TopAbs_FACE)
+    while explorer.More():
+        face = topods.Face(explorer.Current())
+        loc = TopLoc_Location()
+        tri = BRep_Tool.Triangulation(face, loc)
+        explorer.Next()
+        if tri is None:
+            continue
+        trsf = loc.Transformation()
+        nodos = np.array([tri.Node(i).Transformed(trsf).Coord() for i in range(1, tri.NbNodes() + 1)])
+        caras = np.array([tri.Triangle(i).Get() for i in range(1, tri.NbTriangles() + 1)]) - 1
+        if face.Orientation() == TopAbs_REVERSED:
+            caras = caras[:, ::-1]
+        vertices.append(nodos)
+        triangulos.append(caras + desplazamiento)
+        desplazamiento += len(nodos)
+    if not vertices:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=int)
+    return np.vstack(vertices), np.vstack(triangulos).astype(int)
+
+
+def area_y_volumen(vertices: np.ndarray, triangulos: np.ndarray):
+    """Área total y volumen encerrado (teorema de la divergencia) de una malla cerrada."""
+    a, b, c = (vertices[triangulos[:, i]] for i in range(3))
+    cruz = np.cross(b - a, c - a)
+    area = 0.5 * np.linalg.norm(cruz, axis=1).sum()
+    volumen = np.einsum("ij,ij->i", a, cruz).sum() / 6.0
+    return float(area), float(abs(volumen))
+
+
+def muestrear_superficie(vertices: np.ndarray, triangulos: np.ndarray, n_puntos: int, rng) -> np.ndarray:
+    """Muestreo uniforme por área de n_puntos sobre la superficie de la malla."""
+    a, b, c = (vertices[triangulos[:, i]] for i in range(3))
+    areas = 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1)
+    indices = rng.choice(len(triangulos), size=n_puntos, p=areas / areas.sum())
+    u, v = rng.random((2, n_puntos))
+    fuera = u + v > 1
+    u[fuera], v[fuera] = 1 - u[fuera], 1 - v[fuera]
+    return a[indices] + u[:, None] * (b[indices] - a[indices]) + v[:, None] * (c[indices] - a[indices])
+
+
+def voxelizar(vertices: np.ndarray, triangulos: np.ndarray, minimo: np.ndarray, paso: float,
+              dims, bloque: int = 512) -> np.ndarray:
+    """
+    Ocupación (dims[0], dims[1], dims[2]) de la malla por paridad de rayos en +Z: para cada
+    columna XY se cuentan los cortes con los triángulos situados por encima de cada vóxel.
+    """
+    nx, ny, nz = dims
+    # Pequeño desplazamiento para que los rayos no pasen exactamente por aristas compartidas
+    xs = minimo[0] + (np.arange(nx) + 0.5 + 1e-4) * paso
+    ys = minimo[1] + (np.arange(ny) + 0.5 + 2e-4) * paso
+    zs = minimo[2] + (np.arange(nz) + 0.5) * paso
+    px, py = (m.ravel() for m in np.meshgrid(xs, ys, indexing="ij"))
+
+    cortes = np.zeros((nx * ny, nz + 1), dtype=np.int32)
+    a_all, b_all, c_all = (vertices[triangulos[:, i]] for i in range(3))
+    for inicio in range(0, len(triangulos), bloque):
+        a, b, c = a_all[inicio:inicio + bloque], b_all[inicio:inicio + bloque], c_all[inicio:inicio + bloque]
+        # Coordenadas baricéntricas de cada columna respecto a la proyección XY de cada triángulo
+        det = (b[:, 1] - c[:, 1]) * (a[:, 0] - c[:, 0]) + (c[:, 0] - b[:, 0]) * (a[:, 1] - c[:, 1])
+        validos = np.abs(det) > 1e-12
+        if not validos.any():
+            continue
+        a, b, c, det = a[validos], b[validos], c[validos], det[validos]
+        dx = px[:, None] - c[None, :, 0]
+        dy = py[:, None] - c[None, :, 1]
+        l1 = ((b[:, 1] - c[:, 1]) * dx + (c[:, 0] - b[:, 0]) * dy) / det
+        l2 = ((c[:, 1] - a[:, 1]) * dx + (a[:, 0] - c[:, 0]) * dy) / det
+        l3 = 1 - l1 - l2
+        dentro = (l1 >= 0) & (l2 >= 0) & (l3 >= 0)
+        columnas, tris = np.nonzero(dentro)
+        if not len(columnas):
+            continue
+        z = l1[columnas, tris] * a[tris, 2] + l2[columnas, tris] * b[tris, 2] + l3[columnas, tris] * c[tris, 2]
+        np.add.at(cortes, (columnas, np.searchsorted(zs, z)), 1)
+
+    # Cortes por encima de cada vóxel (suma acumulada inversa) -> paridad
+    encima = np.cumsum(cortes[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    return (encima % 2 == 1).reshape(nx, ny, nz)
+
+
+def _centrar(vertices: np.ndarray) -> np.ndarray:
+    return vertices - (vertices.max(axis=0) + vertices.min(axis=0)) / 2
+
+
+def evaluar_pieza(step_generado: str, step_referencia: str, n_puntos: int = 20000,
+                  resolucion: int = 64, semilla: int = 0) -> dict:
+    """
+    Compara una pieza generada con una de referencia.
+    Retorna un dict con chamfer, hausdorff, hausdorff_p95 (también relativas a la diagonal de
+    la referencia), iou (vóxeles), delta_volumen_rel y delta_area_rel.
+    """
+    rng = np.random.default_rng(semilla)
+    v_gen, t_gen = cargar_malla(step_generado)
+    v_ref, t_ref = cargar_malla(step_referencia)
+    if not len(t_gen) or not len(t_ref):
+        return {"generado": step_generado, "referencia": step_referencia, "error": "malla vacía"}
+    v_gen, v_ref = _centrar(v_gen), _centrar(v_ref)
+
+    p_gen = muestrear_superficie(v_gen, t_gen, n_puntos, rng)
+    p_ref = muestrear_superficie(v_ref, t_ref, n_puntos, rng)
+    d_gen_ref, _ = cKDTree(p_ref).query(p_gen, workers=-1)
+    d_ref_gen, _ = cKDTree(p_gen).query(p_ref, workers=-1)
+    chamfer = 0.5 * (d_gen_ref.mean() + d_ref_gen.mean())
+    hausdorff = max(d_gen_ref.max(), d_ref_gen.max())
+    hausdorff_p95 = max(np.percentile(d_gen_ref, 95), np.percentile(d_ref_gen, 95))
+
+    # Rejilla común a ambas piezas
+    minimo = np.minimum(v_gen.min(axis=0), v_ref.min(axis=0))
+    maximo = np.maximum(v_gen.max(axis=0), v_ref.max(axis=0))
+    paso = (maximo - minimo).max() / resolucion
+    dims = np.maximum(np.ceil((maximo - minimo) / paso).astype(int), 1)
+    vox_gen = voxelizar(v_gen, t_gen, minimo, paso, dims)
+    vox_ref = voxelizar(v_ref, t_ref, minimo, paso, dims)
+    union = np.logical_or(vox_gen, vox_ref).sum()
+    iou = np.logical_and(vox_gen, vox_ref).sum() / union if union else 0.0
+
+    area_gen, vol_gen = area_y_volumen(v_gen, t_gen)
+    area_ref, vol_ref = area_y_volumen(v_ref, t_ref)
+    diagonal = float(np.linalg.norm(v_ref.max(axis=0) - v_ref.min(axis=0))) or 1.0
+    return {
+        "generado": step_generado,
+        "referencia": step_referencia,
+        "chamfer": float(chamfer),
+        "hausdorff": float(hausdorff),
+        "hausdorff_p95": float(hausdorff_p95),
+        "chamfer_rel": float(chamfer / diagonal),
+        "hausdorff_rel": float(hausdorff / diagonal),
+        "iou": float(iou),
+        "volumen": vol_gen,
+        "volumen_referencia": vol_ref,
+        "delta_volumen_rel": (vol_gen - vol_ref) / vol_ref if vol_ref else None,
+        "area": area_gen,
+        "area_referencia": area_ref,
+        "delta_area_rel": (area_gen - area_ref) / area_ref if area_ref else None,
+    }
+
+
+def _evaluar_par(args):
+    generado, referencia, kwargs = args
+    try:
+        return evaluar_pieza(generado, referencia, **kwargs)
+    except Exception as e:
+        return {"generado": generado, "referencia": referencia, "error": str(e)}
+
+
+def evaluar_corpus(pares, procesos: int = None, **kwargs) -> list:
+    """
+    Evalúa en paralelo (un proceso por par) una lista de pares (step_generado, step_referencia).
+    Los kwargs se pasan a evaluar_pieza. Devuelve las métricas en el mismo orden que los pares.
+    """
+    trabajos = [(g, r, kwargs) for g, r in pares]
+    if procesos == 1 or len(trabajos) <= 1:
+        return [_evaluar_par(t) for t in trabajos]
+    with ProcessPoolExecutor(max_workers=procesos) as executor:
+        return list(executor.map(_evaluar_par, trabajos))
+
+
+def es_convergente(metricas: dict, iou_minimo: float = 0.9, chamfer_rel_maximo: float = 0.01) -> bool:
+    """Comprobación barata de convergencia: la pieza se considera equivalente a la referencia."""
+    if "error" in metricas:
+        return False
+    return metricas["iou"] >= iou_minimo and metricas["chamfer_rel"] <= chamfer_rel_maximo
+
+
+def _pares_de_directorios(dir_generado: str, dir_referencia: str) -> list:
+    """Empareja por nombre de archivo (sin extensión) los .step/.stp de dos directorios."""
+    def indexar(directorio):
+        return {os.path.splitext(f)[0]: os.path.join(directorio, f)
+                for f in os.listdir(directorio) if f.lower().endswith((".step", ".stp"))}
+    generados, referencias = indexar(dir_generado), indexar(dir_referencia)
+    return [(generados[n], referencias[n]) for n in sorted(generados.keys() & referencias.keys())]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Métricas geométricas entre piezas generadas y de referencia.")
+    parser.add_argument("generado", help="Archivo .step generado, o directorio con --corpus")
+    parser.add_argument("referencia", help="Archivo .step de referencia, o directorio con --corpus")
+    parser.add_argument("--corpus", action="store_true", help="Empareja por nombre los .step de dos directorios")
+    parser.add_argument("--puntos", type=int, default=20000)
+    parser.add_argument("--resolucion", type=int, default=64)
+    parser.add_argument("--procesos", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.corpus:
+        pares = _pares_de_directorios(args.generado, args.referencia)
+    else:
+        pares = [(args.generado, args.referencia)]
+    for metricas in evaluar_corpus(pares, procesos=args.procesos, n_puntos=args.puntos, resolucion=args.resolucion):
+        json.dump(metricas, sys.stdout, ensure_ascii=False)
+        sys.stdout.write("\n")
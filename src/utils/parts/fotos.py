@@ -15,6 +15,9 @@ def save_view_as_image(display, filename, camera_position):
     """ Save the current view from display to an image file. """
     display.View.SetProj(camera_position[0], camera_position[1], camera_position[2])
     display.FitAll()
+    # The previous image may be a read-only hard link into the artifact store: unlink it, never overwrite it
+    if os.path.exists(filename):
+        os.remove(filename)
     display.View.Dump(filename)  # Captures the view into an image file
     
     
@@ -0,0 +1,33 @@
+import os
+import json
+import threading
+from typing import Optional
+
+# Archivos JSON locales: las bases de conocimiento de kb/ (errores, ejemplos, plantillas, rutas de
+# modelos) y el estado del modo lote. Cada módulo serializa sus escrituras con su propio lock;
+# aquí solo se resuelve la lectura y la escritura atómica.
+KB_DIR = os.getenv("CQ_KB_DIR", "kb")
+
+
+def cargar_json(ruta: str, por_defecto):
+    """Contenido del archivo, o por_defecto si todavía no existe."""
+    if not os.path.exists(ruta):
+        return por_defecto
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def guardar_json(ruta: str, datos, indent: Optional[int] = 1) -> None:
+    """
+    Escribe el archivo de forma atómica: primero en un temporal propio del proceso y del hilo
+    (dos escritores nunca comparten temporal) y después os.replace sobre la ruta final.
+    """
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    tmp_path = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False, indent=indent)
+        os.replace(tmp_path, ruta)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import glob
+import uuid
+import hashlib
+import argparse
+import threading
+from langgraph.types import interrupt, Command
+from src.utils.parts.artefactos import cerrar_ejecucion
+from src.utils.parts.kb import cargar_json, guardar_json
+
+# Modo lote (CQ_MODO_LOTE=1): en lugar de llamar al LLM de forma síncrona, completar() encola cada
+# petición en un archivo JSONL con el formato de la Batch API de OpenAI y suspende el grafo con
+# interrupt(). Cuando los resultados se ingieren, las ejecuciones se reanudan y la misma petición
+# (mismo custom_id: hash de modelo, mensajes y parámetros) se responde desde los resultados.
+#
+# Ciclo típico de un barrido nocturno:
+#   python -m src.utils.parts.lotes barrido piezas.jsonl   # ejecuta hasta la primera suspensión
+#   python -m src.utils.parts.lotes enviar                 # sube lotes/pendientes.jsonl a la Batch API
+#   python -m src.utils.parts.lotes recoger                # descarga e ingiere los lotes terminados
+#   python -m src.utils.parts.lotes reanudar               # reanuda las ejecuciones (encola la siguiente ronda)
+# Sin red, 'simular' responde las peticiones pendientes desde un archivo de fixtures.
+# Cada barrido tiene su propio id: los hilos del checkpointer son '<barrido>:<nombre_pieza>' y
+# lotes/hilos.json guarda {hilo: {'nombre_pieza', 'barrido', 'estado'}}, así que el barrido de la
+# noche siguiente empieza ejecuciones nuevas en lugar de continuar las anteriores.
+LOTES_DIR = os.getenv("CQ_LOTES_DIR", "lotes")
+PENDIENTES_PATH = os.path.join(LOTES_DIR, "pendientes.jsonl")
+RESULTADOS_PATH = os.path.join(LOTES_DIR, "resultados.jsonl")
+ENVIOS_PATH = os.path.join(LOTES_DIR, "envios.json")
+HILOS_PATH = os.path.join(LOTES_DIR, "hilos.json")
+CONTADOS_PATH = os.path.join(LOTES_DIR, "contados.json")
+CHECKPOINTS_PATH = os.path.join(LOTES_DIR, "checkpoints.sqlite")
+ENVIADOS_DIR = os.path.join(LOTES_DIR, "enviados")
+SALIDAS_DIR = os.path.join(LOTES_DIR, "salidas")
+ENDPOINT = "/v1/chat/completions"
+# Errores transitorios del lote: no se guardan como resultado y la petición se vuelve a encolar al reanudar
+CODIGOS_REINTENTABLES = ("batch_expired", "batch_cancelled", "rate_limit_exceeded", "server_error")
+
+_lock = threading.Lock()
+_resultados = {"mtime": None, "por_id": {}}
+
+
+def modo_lote_activo() -> bool:
+    return os.getenv("CQ_MODO_LOTE") == "1"
+
+
+def calcular_custom_id(modelo: str, messages: list, params: dict) -> str:
+    """Identificador estable de una petición: la misma petición en otra ejecución reutiliza el resultado."""
+    clave = json.dumps({"model": modelo, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(clave.encode("utf-8")).hexdigest()[:32]
+
+
+def _leer_jsonl(ruta: str) -> list:
+    if not os.path.exists(ruta):
+        return []
+    with open(ruta, "r", encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def _buscar_resultado(custom_id: str):
+    # Los resultados se releen solo si el archivo ha cambiado (otra ejecución o 'ingerir')
+    with _lock:
+        estado = os.stat(RESULTADOS_PATH) if os.path.exists(RESULTADOS_PATH) else None
+        mtime = (estado.st_mtime_ns, estado.st_size) if estado else None
+        if mtime != _resultados["mtime"]:
+            por_id = {}
+            for r in _leer_jsonl(RESULTADOS_PATH):
+                # Gana la última línea, salvo que un error llegue después de una respuesta correcta
+                anterior = por_id.get(r["custom_id"])
+                if anterior is None or anterior.get("error") or not r.get("error"):
+                    por_id[r["custom_id"]] = r
+            _resultados["por_id"] = por_id
+            _resultados["mtime"] = mtime
+        return _resultados["por_id"].get(custom_id)
+
+
+def _ids_en_vuelo() -> set:
+    ids = {p["custom_id"] for p in _leer_jsonl(PENDIENTES_PATH)}
+    for ruta in glob.glob(os.path.join(ENVIADOS_DIR, "*.jsonl")):
+        ids |= {p["custom_id"] for p in _leer_jsonl(ruta)}
+    return ids
+
+
+def encolar(custom_id: str, modelo: str, messages: list, params: dict) -> bool:
+    """Añade la petición a lotes/pendientes.jsonl si no está ya pendiente o enviada. Devuelve si se añadió."""
+    with _lock:
+        if custom_id in _ids_en_vuelo():
+            return False
+        os.makedirs(LOTES_DIR, exist_ok=True)
+        linea = {"custom_id": custom_id, "method": "POST", "url": ENDPOINT,
+                 "body": {"model": modelo, "messages": messages, **params}}
+        with open(PENDIENTES_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(linea, ensure_ascii=False) + "\n")
+        return True
+
+
+def completar_en_lote(etapa: str, modelo: str, messages: list, params: dict) -> str:
+    """
+    Devuelve el contenido de la respuesta si ya se ingirió; si no, encola la petición y suspende el
+    grafo. Al reanudar, el nodo se vuelve a ejecutar desde el principio y llega aquí con el resultado.
+    Lanza RuntimeError si la petición falló en el lote (completar() escala entonces de modelo).
+    """
+    custom_id = calcular_custom_id(modelo, messages, params)
+    resultado = _buscar_resultado(custom_id)
+    while resultado is None:
+        encolar(custom_id, modelo, messages, params)
+        # Dentro de una misma ejecución del nodo, un interrupt ya respondido devuelve el valor de
+        # reanudación sin suspender: se vuelve a comprobar y, si sigue sin resultado, se suspende de nuevo
+        interrupt({"custom_id": custom_id, "etapa": etapa, "modelo": modelo})
+        resultado = _buscar_resultado(custom_id)
+    if resultado.get("error"):
+        raise RuntimeError(f"Petición {custom_id} fallida en el lote: {resultado['error']}")
+    return resultado["contenido"]
+
+
+def primer_uso(custom_id: str) -> bool:
+    """
+    True solo la primera vez que se entrega el resultado de esta petición. Al reanudar, el nodo se
+    repite desde el principio y recibe otra vez las respuestas que ya tenía: no deben volver a contar
+    en las estadísticas.
+    """
+    with _lock:
+        contados = cargar_json(CONTADOS_PATH, [])
+        if custom_id in contados:
+            return False
+        contados.append(custom_id)
+        guardar_json(CONTADOS_PATH, contados, indent=None)
+        return True
+
+
+def _es_reintentable(status_code, error) -> bool:
+    if status_code == 429 or (status_code or 0) >= 500:
+        return True
+    return isinstance(error, dict) and error.get("code") in CODIGOS_REINTENTABLES
+
+
+def ingerir(ruta_salida: str) -> dict:
+    """
+    Ingiere un archivo de salida (o de errores) de la Batch API: una línea por petición con
+    'custom_id', 'response' {'status_code', 'body'} y 'error'. Solo se guardan las respuestas y
+    los errores definitivos; los transitorios (caducidad del lote, 429, 5xx) se descartan para que
+    la petición se vuelva a encolar. Devuelve {'ok', 'errores', 'reintentables'}.
+    """
+    nuevos, errores, reintentables = [], 0, 0
+    for linea in _leer_jsonl(ruta_salida):
+        respuesta = linea.get("response") or {}
+        error = linea.get("error")
+        if not error and respuesta.get("status_code") != 200:
+            error = (respuesta.get("body") or {}).get("error") or f"status {respuesta.get('status_code')}"
+        if error and _es_reintentable(respuesta.get("status_code"), error):
+            reintentables += 1
+        elif error:
+            errores += 1
+            nuevos.append({"custom_id": linea["custom_id"], "contenido": None, "error": json.dumps(error, ensure_ascii=False)})
+        else:
+            contenido = respuesta["body"]["choices"][0]["message"]["content"]
+            nuevos.append({"custom_id": linea["custom_id"], "contenido": contenido, "error": None})
+    with _lock:
+        os.makedirs(LOTES_DIR, exist_ok=True)
+        with open(RESULTADOS_PATH, "a", encoding="utf-8") as f:
+            for r in nuevos:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    return {"ok": len(nuevos) - errores, "errores": errores, "reintentables": reintentables}
+
+
+def _texto_mensajes(messages: list) -> str:
+    partes = []
+    for m in messages:
+        contenido = m.get("content")
+        if isinstance(contenido, list):
+            partes.extend(p.get("text", "") for p in contenido if p.get("type") == "text")
+        else:
+            partes.append(contenido or "")
+    return "\n".join(partes)
+
+
+def _mover_pendientes(nombre_envio: str) -> str:
+    """Mueve lotes/pendientes.jsonl a lotes/enviados/<nombre_envio>.jsonl (las peticiones quedan en vuelo)."""
+    os.makedirs(ENVIADOS_DIR, exist_ok=True)
+    destino = os.path.join(ENVIADOS_DIR, f"{nombre_envio}.jsonl")
+    os.replace(PENDIENTES_PATH, destino)
+    return destino
+
+
+def simular(ruta_fixtures: str) -> dict:
+    """
+    Sustituto local de la Batch API para pruebas sin red: responde cada petición pendiente con la
+    primera regla del archivo de fixtures cuyo texto 'contiene' aparece en los mensajes.
+    Fixtures: JSON con una lista de {'contiene': str, 'respuesta': str} ('contiene': '' responde a todo).
+    Las peticiones sin regla se devuelven como error, igual que una línea fallida del lote real.
+    """
+    with open(ruta_fixtures, "r", encoding="utf-8") as f:
+        reglas = json.load(f)
+    with _lock:
+        pendientes = _leer_jsonl(PENDIENTES_PATH)
+        if not pendientes:
+            return {"ok": 0, "errores": 0, "reintentables": 0}
+        nombre_envio = f"simulado-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        enviado = _mover_pendientes(nombre_envio)
+    lineas = []
+    for peticion in pendientes:
+        texto = _texto_mensajes(peticion["body"]["messages"])
+        regla = next((r for r in reglas if r.get("contiene", "") in texto), None)
+        if regla is None:
+            lineas.append({"custom_id": peticion["custom_id"], "response": None,
+                           "error": {"code": "sin_fixture", "message": "Ninguna regla de fixtures coincide"}})
+            continue
+        body = {"model": peticion["body"]["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": regla["respuesta"]}, "finish_reason": "stop"}]}
+        lineas.append({"custom_id": peticion["custom_id"], "response": {"status_code": 200, "body": body}, "error": None})
+    os.makedirs(SALIDAS_DIR, exist_ok=True)
+    ruta_salida = os.path.join(SALIDAS_DIR, f"{nombre_envio}.jsonl")
+    with open(ruta_salida, "w", encoding="utf-8") as f:
+        for linea in lineas:
+            f.write(json.dumps(linea, ensure_ascii=False) + "\n")
+    resultado = ingerir(ruta_salida)
+    os.replace(enviado, enviado[:-len(".jsonl")] + ".simulado")
+    return resultado
+
+
+def _cliente_openai():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def enviar() -> str:
+    """Sube las peticiones pendientes a la Batch API de OpenAI. Devuelve el id del lote o None."""
+    with _lock:
+        if not _leer_jsonl(PENDIENTES_PATH):
+            return None
+        cliente = _cliente_openai()
+        with open(PENDIENTES_PATH, "rb") as f:
+            archivo = cliente.files.create(file=f, purpose="batch")
+        lote = cliente.batches.create(input_file_id=archivo.id, endpoint=ENDPOINT, completion_window="24h")
+        _mover_pendientes(lote.id)
+        envios = cargar_json(ENVIOS_PATH, {})
+        envios[lote.id] = {"estado": lote.status, "enviado": time.time()}
+        guardar_json(ENVIOS_PATH, envios)
+    return lote.id
+
+
+def recoger() -> dict:
+    """
+    Consulta los lotes enviados y, de los terminados, descarga e ingiere las salidas y los errores.
+    Las peticiones de lotes caducados, cancelados o fallidos, y las que fallaron con un error
+    transitorio, dejan de estar en vuelo y se vuelven a encolar al reanudar. Devuelve {id_lote: estado}.
+    """
+    cliente = _cliente_openai()
+    envios = cargar_json(ENVIOS_PATH, {})
+    for lote_id, envio in envios.items():
+        if envio.get("ingerido"):
+            continue
+        lote = cliente.batches.retrieve(lote_id)
+        envio["estado"] = lote.status
+        if lote.status not in ("completed", "expired", "cancelled", "failed"):
+            continue
+        os.makedirs(SALIDAS_DIR, exist_ok=True)
+        for sufijo, archivo_id in (("", lote.output_file_id), ("-errores", lote.error_file_id)):
+            if not archivo_id:
+                continue
+            ruta_salida = os.path.join(SALIDAS_DIR, f"{lote_id}{sufijo}.jsonl")
+            with open(ruta_salida, "w", encoding="utf-8") as f:
+                f.write(cliente.files.content(archivo_id).text)
+            ingerir(ruta_salida)
+        enviado = os.path.join(ENVIADOS_DIR, f"{lote_id}.jsonl")
+        if os.path.exists(enviado):
+            os.replace(enviado, enviado[:-len(".jsonl")] + f".{lote.status}")
+        envio["ingerido"] = True
+    guardar_json(ENVIOS_PATH, envios)
+    return {lote_id: envio["estado"] for lote_id, envio in envios.items()}
+
+
+def _grafo_con_checkpointer():
+    """
+    Compila el grafo con un checkpointer persistente (necesario para suspender y reanudar entre procesos).
+    Sin langgraph-checkpoint-sqlite se usa uno en memoria, válido solo dentro del mismo proceso (barrido --simular).
+    """
+    from src.graph.grafo import builder
+    try:
+        import sqlite3
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        os.makedirs(LOTES_DIR, exist_ok=True)
+        checkpointer = SqliteSaver(sqlite3.connect(CHECKPOINTS_PATH, check_same_thread=False))
+    except ImportError:
+        from langgraph.checkpoint.memory import InMemorySaver
+        print("langgraph-checkpoint-sqlite no está instalado: las ejecuciones suspendidas solo se conservan en este proceso.")
+        checkpointer = InMemorySaver()
+    return builder.compile(checkpointer=checkpointer)
+
+
+def _avanzar(graph, hilo: str, entrada) -> str:
+    config = {"configurable": {"thread_id": hilo}, "recursion_limit": 100}
+    previo = graph.get_state(config)
+    # Un hilo con checkpoint no se vuelve a lanzar con una entrada nueva, y uno terminado no se reanuda:
+    # el grafo continuaría la ejecución anterior (subpiezas acumuladas, historial, run_id)
+    if previo.values and (not isinstance(entrada, Command) or not previo.next):
+        estado = "suspendido" if previo.next else "terminado"
+        print(f"    [{hilo}] ya existe ({estado}): no se vuelve a lanzar")
+        return estado
+    try:
+        graph.invoke(entrada, config)
+    except Exception as e:
+        print(f"    [{hilo}] error: {e}")
+        # La ejecución no llegará a 'cleanup': se cierra su manifiesto y se archiva su parts/
+        valores = graph.get_state(config).values
+        if valores.get("run_id"):
+            cerrar_ejecucion(valores["run_id"], "fallida", valores.get("nombre_pieza"), {'error': str(e)[:500]})
+        return "error"
+    estado = graph.get_state(config)
+    return "suspendido" if estado.next else "terminado"
+
+
+def barrido(graph, piezas: list, hilos: dict, descomponer: bool = False) -> str:
+    """Lanza una ejecución nueva por pieza en hilos propios de este barrido. Devuelve el id del barrido."""
+    barrido_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    for pieza in piezas:
+        nombre_pieza = pieza["nombre_pieza"]
+        if descomponer:
+            pieza.setdefault("descomponer", True)
+        pieza.setdefault("run_id", f"{nombre_pieza}-{barrido_id}")
+        hilo = f"{barrido_id}:{nombre_pieza}"
+        hilos[hilo] = {"nombre_pieza": nombre_pieza, "barrido": barrido_id, "estado": _avanzar(graph, hilo, pieza)}
+    return barrido_id
+
+
+def reanudar(graph, hilos: dict) -> dict:
+    """Reanuda las ejecuciones suspendidas; cada nodo suspendido se reejecuta y lee sus resultados."""
+    for hilo, info in hilos.items():
+        if info["estado"] != "suspendido":
+            continue
+        interrupciones = graph.get_state({"configurable": {"thread_id": hilo}}).interrupts
+        info["estado"] = _avanzar(graph, hilo, Command(resume={i.id: True for i in interrupciones}))
+    return hilos
+
+
+def _cargar_hilos() -> dict:
+    hilos = cargar_json(HILOS_PATH, {})
+    # Formato anterior: {nombre_pieza: estado}, con el nombre como hilo y sin barrido
+    return {hilo: info if isinstance(info, dict) else {"nombre_pieza": hilo, "barrido": None, "estado": info}
+            for hilo, info in hilos.items()}
+
+
+def _resumen(hilos: dict) -> str:
+    conteo = {}
+    for info in hilos.values():
+        conteo[info["estado"]] = conteo.get(info["estado"], 0) + 1
+    return (f"Ejecuciones: {conteo or '-'} - peticiones pendientes de enviar: {len(_leer_jsonl(PENDIENTES_PATH))}, "
+            f"en vuelo: {len(_ids_en_vuelo())}, resultados ingeridos: {len(_leer_jsonl(RESULTADOS_PATH))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Modo lote: peticiones al LLM en archivos de la Batch API de OpenAI.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_barrido = sub.add_parser("barrido", help="Lanza una ejecución por pieza de un JSONL {nombre_pieza, prompt_entrada}")
+    p_barrido.add_argument("piezas")
+    p_barrido.add_argument("--descomponer", action="store_true")
+    p_barrido.add_argument("--simular", metavar="FIXTURES", help="Responde con fixtures y reanuda hasta terminar (sin red)")
+    p_barrido.add_argument("--max-rondas", type=int, default=50)
+    sub.add_parser("reanudar", help="Reanuda las ejecuciones suspendidas del barrido")
+    p_ingerir = sub.add_parser("ingerir", help="Ingiere un archivo de salida de la Batch API")
+    p_ingerir.add_argument("salida")
+    p_simular = sub.add_parser("simular", help="Responde las peticiones pendientes desde un archivo de fixtures")
+    p_simular.add_argument("fixtures")
+    sub.add_parser("enviar", help="Sube las peticiones pendientes a la Batch API")
+    sub.add_parser("recoger", help="Descarga e ingiere los lotes terminados")
+    sub.add_parser("estado", help="Resumen de ejecuciones y peticiones")
+    args = parser.parse_args()
+
+    os.environ["CQ_MODO_LOTE"] = "1"
+    hilos = _cargar_hilos()
+    if args.comando == "barrido":
+        graph = _grafo_con_checkpointer()
+        barrido_id = barrido(graph, _leer_jsonl(args.piezas), hilos, args.descomponer)
+        print(f"Barrido {barrido_id}")
+        guardar_json(HILOS_PATH, hilos)
+        for ronda in range(args.max_rondas if args.simular else 0):
+            if not any(info["estado"] == "suspendido" for info in hilos.values()):
+                break
+            print(f"Ronda {ronda + 1}: {simular(args.simular)}")
+            hilos = reanudar(graph, hilos)
+            guardar_json(HILOS_PATH, hilos)
+    elif args.comando == "reanudar":
+        hilos = reanudar(_grafo_con_checkpointer(), hilos)
+        guardar_json(HILOS_PATH, hilos)
+    elif args.comando == "ingerir":
+        print(ingerir(args.salida))
+    elif args.comando == "simular":
+        print(simular(args.fixtures))
+    elif args.comando == "enviar":
+        print(enviar() or "No hay peticiones pendientes.")
+    elif args.comando == "recoger":
+        print(recoger())
+    print(_resumen(hilos))
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import threading
+from openai import OpenAI
+from langgraph.errors import GraphInterrupt
+from src.utils.parts.lotes import modo_lote_activo, completar_en_lote, calcular_custom_id, primer_uso
+from src.utils.parts.kb import KB_DIR, cargar_json, guardar_json
+
+# Capa de enrutado de modelos por etapa. Cada etapa tiene una lista de modelos ordenada de
+# más barato a más potente: se empieza por el primero (o por el nivel que indique el llamador)
+# y se escala al siguiente si la llamada falla o la respuesta no supera la validación.
+# Con CQ_MODO_LOTE=1 las peticiones se encolan para la Batch API en lugar de hacerse al momento (lotes.py).
+# Se puede sobrescribir con la variable de entorno CQ_RUTAS_MODELOS, p. ej.:
+#   CQ_RUTAS_MODELOS='{"questions": ["gpt-4o"], "reparador": ["gpt-4o-mini", "gpt-4o"]}'
+RUTAS_POR_DEFECTO = {
+    "generar_pieza": ["gpt-4o"],
+    "questions": ["gpt-4o-mini", "gpt-4o"],
+    "answers": ["gpt-4o"],
+    "feedback": ["gpt-4o-mini", "gpt-4o"],
+    "reparador": ["gpt-4o-mini", "gpt-4o"],
+    "descomponer": ["gpt-4o-mini", "gpt-4o"],
+    "feedforward": ["gpt-4o-mini", "gpt-4o"],
+}
+
+KB_RUTAS_PATH = os.path.join(KB_DIR, "rutas.json")
+
+_cliente = None
+# Las etapas pueden llamar al LLM desde varios hilos (subpiezas en paralelo)
+_lock = threading.Lock()
+
+
+def _get_cliente() -> OpenAI:
+    global _cliente
+    if _cliente is None:
+        _cliente = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _cliente
+
+
+def modelos_de(etapa: str) -> list:
+    """Lista de modelos (de barato a potente) configurada para una etapa."""
+    rutas = dict(RUTAS_POR_DEFECTO)
+    if os.getenv("CQ_RUTAS_MODELOS"):
+        rutas.update(json.loads(os.getenv("CQ_RUTAS_MODELOS")))
+    return rutas.get(etapa) or RUTAS_POR_DEFECTO["generar_pieza"]
+
+
+def _cargar_estadisticas() -> dict:
+    return cargar_json(KB_RUTAS_PATH, {})
+
+
+def _actualizar_estadisticas(etapa: str, modelo: str, latencia: float = None, ok: bool = None) -> None:
+    with _lock:
+        estadisticas = _cargar_estadisticas()
+        ruta = estadisticas.setdefault(etapa, {}).setdefault(
+            modelo, {"llamadas": 0, "exitos": 0, "fallos": 0, "latencia_total": 0.0}
+        )
+        if latencia is not None:
+            ruta["llamadas"] += 1
+            ruta["latencia_total"] = round(ruta["latencia_total"] + latencia, 3)
+        if ok is not None:
+            ruta["exitos" if ok else "fallos"] += 1
+        guardar_json(KB_RUTAS_PATH, estadisticas)
+
+
+def registrar_resultado(etapa: str, modelo: str, ok: bool) -> None:
+    """Anota el resultado de una llamada cuyo éxito solo se conoce después (p. ej. una reparación ejecutada)."""
+    _actualizar_estadisticas(etapa, modelo, ok=ok)
+
+
+def _anotar(etapa: str, modelo: str, messages: list, kwargs: dict, inicio: float, ok: bool = None) -> None:
+    if not modo_lote_activo():
+        _actualizar_estadisticas(etapa, modelo, time.perf_counter() - inicio, ok=ok)
+    # En modo lote la latencia medida es la de leer el resultado guardado, no la del LLM, y un nodo
+    # reanudado recibe otra vez las respuestas anteriores: solo cuenta el resultado, y una vez
+    elif primer_uso(calcular_custom_id(modelo, messages, kwargs)):
+        _actualizar_estadisticas(etapa, modelo, ok=ok)
+
+
+def completar(etapa: str, messages: list, nivel: int = 0, validar=None, diferido: bool = False, **kwargs):
+    """
+    Llama al LLM con el modelo de la etapa correspondiente al nivel indicado, escalando de modelo
+    si la llamada lanza una excepción o validar(contenido) devuelve False (baja confianza).
+
+    Parámetros:
+      - etapa: clave de RUTAS_POR_DEFECTO ('questions', 'feedback', 'reparador', ...).
+      - messages: mensajes de chat.completions.
+      - nivel: índice del primer modelo a probar (se limita al último disponible).
+      - validar: función opcional contenido -> bool.
+      - diferido: si True, el éxito se anota después con registrar_resultado.
+      - En modo lote (CQ_MODO_LOTE=1) la llamada puede suspender el grafo con interrupt() hasta que
+        se ingiera el resultado; la excepción de LangGraph no se captura.
+      - kwargs: parámetros adicionales para chat.completions.create (temperature, max_tokens...).
+
+    Retorna:
+      - (contenido, modelo) de la primera respuesta válida, o de la última si ninguna lo es.
+    """
+    # La clave solo hace falta para las llamadas síncronas: en modo lote las peticiones se encolan
+    if not modo_lote_activo() and not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("OPENAI_API_KEY no está configurada en el entorno.")
+    modelos = modelos_de(etapa)
+    nivel = min(max(nivel, 0), len(modelos) - 1)
+    ultimo_error, ultima_respuesta = None, None
+    for modelo in modelos[nivel:]:
+        inicio = time.perf_counter()
+        try:
+            if modo_lote_activo():
+                contenido = completar_en_lote(etapa, modelo, messages, kwargs)
+            else:
+                response = _get_cliente().chat.completions.create(model=modelo, messages=messages, **kwargs)
+                contenido = response.choices[0].message.content
+        except GraphInterrupt:
+            # Modo lote: la petición queda encolada y el grafo se suspende hasta ingerir su resultado
+            raise
+        except Exception as e:
+            _anotar(etapa, modelo, messages, kwargs, inicio, ok=False)
+            print(f"    [{etapa}] {modelo} falló ({e}), escalando de modelo.")
+            ultimo_error = e
+            continue
+        valido = validar is None or validar(contenido)
+        _anotar(etapa, modelo, messages, kwargs, inicio, ok=None if diferido and valido else valido)
+        ultima_respuesta = (contenido, modelo)
+        if valido:
+            return ultima_respuesta
+        print(f"    [{etapa}] respuesta de {modelo} con baja confianza, escalando de modelo.")
+    if ultima_respuesta is not None:
+        return ultima_respuesta
+    raise ultimo_error
+
+
+def resumen_estadisticas() -> str:
+    """Tabla breve de llamadas, tasa de éxito y latencia media por etapa y modelo."""
+    lineas = []
+    for etapa, modelos in sorted(_cargar_estadisticas().items()):
+        for modelo, r in modelos.items():
+            resueltas = r["exitos"] + r["fallos"]
+            tasa = f"{r['exitos'] / resueltas:.0%}" if resueltas else "-"
+            media = r["latencia_total"] / r["llamadas"] if r["llamadas"] else 0.0
+            lineas.append(f"{etapa:<14} {modelo:<14} llamadas: {r['llamadas']:>5}  éxito: {tasa:>4}  latencia media: {media:.2f}s")
+    return "\n".join(lineas) or "Sin estadísticas de rutas."
+
+
+if __name__ == "__main__":
+    print(resumen_estadisticas())
@@ -0,0 +1,349 @@
+import os
+import re
+import json
+import threading
+import unicodedata
+from src.utils.parts.kb import KB_DIR, cargar_json, guardar_json
+
+# Vía rápida sin LLM: un extractor local de intención/parámetros para piezas primitivas
+# (cajas, placas con agujeros, cilindros, bridas y escuadras) y plantillas paramétricas
+# de CadQuery que generan directamente el código de la pieza.
+KB_PLANTILLAS_PATH = os.path.join(KB_DIR, "plantillas.json")
+# Las subpiezas consultan la vía rápida en paralelo
+_lock = threading.Lock()
+
+# Confianza mínima para saltarse generar_pieza
+CONFIANZA_MINIMA = 0.8
+# Una sola palabra sin cubrir basta para bajar de CONFIANZA_MINIMA
+PENALIZACION_NO_CUBIERTA = 0.25
+
+NUM = r"(\d+(?:[.,]\d+)?)"
+
+# Características que ninguna plantilla sabe construir: si aparecen, se delega en el LLM
+CARACTERISTICAS_NO_SOPORTADAS = [
+    "redonde", "fillet", "chafl", "chamfer", "bisel", "rosca", "thread", "ranura", "slot",
+    "engran", "gear", "texto", "logo", "nervio", "rib", "avellan", "countersink", "hexagon",
+    "esfera", "sphere", "cono", "cone", "piramide", "pyramid", "muelle", "spring", "helic",
+    "toro", "torus", "curva", "arco", "loft", "sweep", "ensambl", "assembly", "pestana", "tab",
+]
+
+# Vocabulario que el extractor entiende (formas, medidas, agujeros y palabras sin contenido).
+# Cualquier otra palabra del prompt describe algo que la plantilla no construiría ('vaciado', 'tapa'...)
+# y resta confianza: la plantilla solo se usa si cubre toda la descripción. Las plantillas trabajan
+# en mm, así que otras unidades ('cm', 'pulgadas') tampoco están en el vocabulario.
+PALABRAS_CONOCIDAS = set("""
+de del con y e en el la lo los las un una unos unas al a the of with and in on at an to for by its it is que
+por para su sus se cada each tiene has have sobre
+genera generar crea crear haz hacer dibuja dibujar modela modelar disena disenar quiero necesito
+create make generate model design draw build
+pieza part objeto object forma shape solido solid simple rectangular rectangle cuadrada cuadrado square
+redonda redondo round circular recto recta macizo maciza
+brida flange escuadra bracket soporte perfil angulo l placa plancha chapa plate plaque cilindro cylinder
+disco disc disk barra rod cubo caja bloque prisma paralelepipedo box cube block
+lado side arista edge espesor grosor thickness thick altura alto height high tall longitud length largo long
+ancho width wide diametro diameter radio radius medida dimension tamano size mm milimetro millimeter x
+agujero taladro orificio hole pasante through cilindrico cylindrical centro central centrado centered center
+middle medio mitad otro otra other another esquina corner exterior externo outer outside interior interno
+inner inside circulo pernos perno bolt circle pcd igual equal distribuido equally spaced repartido alrededor
+around cara superior top face
+""".lower().split())
+
+NUMEROS_ESCRITOS = {
+    "un": 1, "uno": 1, "una": 1, "one": 1, "a": 1, "dos": 2, "two": 2, "tres": 3, "three": 3,
+    "cuatro": 4, "four": 4, "cinco": 5, "five": 5, "seis": 6, "six": 6, "ocho": 8, "eight": 8,
+}
+
+CABECERA = "import os\nos.makedirs('parts', exist_ok=True)\n\nimport cadquery as cq\n"
+
+
+def _normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return texto.replace("×", "x").replace(",", ".")
+
+
+def _valor(texto: str, claves: str):
+    """Busca un número asociado a una palabra clave ('radio 2', 'radio de 2', '2 mm de radio')."""
+    m = re.search(rf"\b(?:{claves})\w*\s*(?:de|of|=|:)?\s*{NUM}", texto)
+    if not m:
+        m = re.search(rf"{NUM}\s*(?:mm)?\s*(?:de|of)?\s*(?:{claves})\b", texto)
+    return float(m.group(1)) if m else None
+
+
+def _dimensiones(texto: str):
+    m = re.search(rf"{NUM}\s*(?:mm)?\s*x\s*{NUM}\s*(?:mm)?(?:\s*x\s*{NUM})?", texto)
+    if not m:
+        return None
+    return [float(g) for g in m.groups() if g is not None]
+
+
+def _diametro(texto: str):
+    d = _valor(texto, "diametro|diameter")
+    if d is not None:
+        return d
+    r = _valor(texto, "radio|radius")
+    return 2 * r if r is not None else None
+
+
+def _diametro_calificado(texto: str, calificadores: str):
+    """Diámetro con calificador ('diámetro exterior de 80', 'outer radius 40')."""
+    for medida, factor in (("diametro|diameter", 1), ("radio|radius", 2)):
+        for patron in (rf"\b(?:{medida})\s+(?:{calificadores})\w*\s*(?:de|of|=|:)?\s*{NUM}",
+                       rf"\b(?:{calificadores})\w*\s+(?:{medida})\s*(?:de|of|=|:)?\s*{NUM}"):
+            m = re.search(patron, texto)
+            if m:
+                return factor * float(m.group(1))
+    return None
+
+
+def _n_agujeros(texto: str) -> int:
+    """Suma todas las menciones de agujeros ('4 agujeros', 'un agujero ... y otro agujero', 'otros 2 taladros')."""
+    palabras = "|".join(NUMEROS_ESCRITOS)
+    total = 0
+    for m in re.finditer(rf"(?:\b(\d+|{palabras})\s+)?(?:\botros?\s+)?(?:(\d+|{palabras})\s+)?"
+                         r"(?:agujero|taladro|orificio|hole)", texto):
+        cantidad = m.group(2) or m.group(1)
+        if cantidad is None:
+            total += 1
+        else:
+            total += int(cantidad) if cantidad.isdigit() else NUMEROS_ESCRITOS[cantidad]
+    return total
+
+
+def _agujero_no_centrado(agujeros: str) -> bool:
+    return bool(re.search(r"lateral|\bside|borde|\bedge|esquina|corner|ciego|blind|profundidad|depth", agujeros))
+
+
+def _palabras_no_cubiertas(texto: str) -> set:
+    """Palabras del prompt que no son forma, medida, agujero ni palabra vacía conocida."""
+    desconocidas = set()
+    for palabra in re.findall(r"[a-z]+", texto):
+        if palabra in NUMEROS_ESCRITOS:
+            continue
+        singulares = {palabra, palabra[:-1] if palabra.endswith("s") else palabra, palabra[:-2] if palabra.endswith("es") else palabra}
+        if not singulares & PALABRAS_CONOCIDAS:
+            desconocidas.add(palabra)
+    return desconocidas
+
+
+def _partir_por_agujero(texto: str):
+    """Separa la descripción del cuerpo de la de los agujeros para no mezclar sus medidas."""
+    m = re.search(r"\b(?:\d+|\w+)?\s*(?:agujero|taladro|orificio|hole)", texto)
+    if not m:
+        return texto, ""
+    return texto[:m.start()], texto[m.start():]
+
+
+# --- Plantillas ---
+
+def _plantilla_caja(cuerpo: str, agujeros: str, n_agujeros: int):
+    if _agujero_no_centrado(agujeros):
+        return None
+    dims = _dimensiones(cuerpo)
+    lado = _valor(cuerpo, "lado|side|arista|edge") or _valor(cuerpo, "cubo|cube")
+    if dims and len(dims) == 3:
+        largo, ancho, alto = dims
+    elif lado is not None or (dims and len(dims) == 1):
+        largo = ancho = alto = lado if lado is not None else dims[0]
+    else:
+        return None
+    params = {"largo": largo, "ancho": ancho, "alto": alto}
+    codigo = f"result = cq.Workplane(\"XY\").box({largo:g}, {ancho:g}, {alto:g})\n"
+    if n_agujeros:
+        if n_agujeros != 1:
+            return None
+        diametro = _diametro(agujeros)
+        if diametro is None or diametro >= min(largo, ancho):
+            return None
+        params["diametro_agujero"] = diametro
+        codigo += f"result = result.faces(\">Z\").workplane().hole({diametro:g})\n"
+    return params, codigo, 0
+
+
+def _plantilla_placa(cuerpo: str, agujeros: str, n_agujeros: int):
+    dims = _dimensiones(cuerpo)
+    if not dims or len(dims) < 2:
+        return None
+    largo, ancho = dims[0], dims[1]
+    # El espesor puede aparecer después de los agujeros ('... con 3 agujeros de 5, espesor 4')
+    claves_espesor = "espesor|grosor|thickness|thick"
+    espesor = dims[2] if len(dims) == 3 else (_valor(cuerpo, claves_espesor) or _valor(agujeros, claves_espesor))
+    por_defecto = 0
+    if espesor is None:
+        espesor, por_defecto = 5.0, por_defecto + 1
+    params = {"largo": largo, "ancho": ancho, "espesor": espesor, "n_agujeros": n_agujeros}
+    codigo = f"result = cq.Workplane(\"XY\").box({largo:g}, {ancho:g}, {espesor:g})\n"
+    if n_agujeros:
+        diametro = _diametro(agujeros)
+        if diametro is None:
+            return None
+        params["diametro_agujero"] = diametro
+        margen = max(1.5 * diametro, 0.1 * min(largo, ancho))
+        if min(largo, ancho) <= 2 * margen:
+            return None
+        if n_agujeros == 1:
+            # Un único agujero solo se sabe hacer en el centro
+            if _agujero_no_centrado(agujeros):
+                return None
+            codigo += f"result = result.faces(\">Z\").workplane().hole({diametro:g})\n"
+        elif n_agujeros == 4 or re.search(r"esquina|corner", agujeros):
+            if n_agujeros != 4:
+                return None
+            codigo += (
+                "result = (result.faces(\">Z\").workplane()\n"
+                f"          .rect({largo - 2 * margen:g}, {ancho - 2 * margen:g}, forConstruction=True)\n"
+                f"          .vertices().hole({diametro:g}))\n"
+            )
+        else:
+            if _agujero_no_centrado(agujeros):
+                return None
+            paso = (largo - 2 * margen) / (n_agujeros - 1)
+            codigo += f"result = result.faces(\">Z\").workplane().rarray({paso:g}, 1, {n_agujeros}, 1).hole({diametro:g})\n"
+    return params, codigo, por_defecto
+
+
+def _plantilla_cilindro(cuerpo: str, agujeros: str, n_agujeros: int):
+    if _agujero_no_centrado(agujeros):
+        return None
+    diametro = _diametro(cuerpo)
+    altura = _valor(cuerpo, "altura|alto|height|high|tall|longitud|length|largo|espesor|thickness")
+    if diametro is None or altura is None:
+        return None
+    params = {"diametro": diametro, "altura": altura}
+    codigo = f"result = cq.Workplane(\"XY\").circle({diametro / 2:g}).extrude({altura:g})\n"
+    if n_agujeros:
+        if n_agujeros != 1:
+            return None
+        diametro_agujero = _diametro(agujeros)
+        if diametro_agujero is None or diametro_agujero >= diametro:
+            return None
+        params["diametro_agujero"] = diametro_agujero
+        codigo += f"result = result.faces(\">Z\").workplane().hole({diametro_agujero:g})\n"
+    return params, codigo, 0
+
+
+def _plantilla_brida(cuerpo: str, agujeros: str, n_agujeros: int):
+    exterior = _diametro_calificado(cuerpo, "exterior|externo|outer|outside") or _diametro(cuerpo)
+    if exterior is None:
+        return None
+    interior = _diametro_calificado(cuerpo, "interior|interno|inner|inside|central")
+    claves_espesor = "espesor|grosor|thickness|thick|altura|alto|height"
+    espesor = _valor(cuerpo, claves_espesor) or _valor(agujeros, claves_espesor)
+    por_defecto = 0
+    if interior is None or interior >= exterior:
+        interior, por_defecto = exterior / 2, por_defecto + 1
+    if espesor is None:
+        espesor, por_defecto = exterior / 10, por_defecto + 1
+    params = {"diametro_exterior": exterior, "diametro_interior": interior, "espesor": espesor, "n_agujeros": n_agujeros}
+    codigo = (
+        f"result = cq.Workplane(\"XY\").circle({exterior / 2:g}).circle({interior / 2:g}).extrude({espesor:g})\n"
+    )
+    if n_agujeros:
+        diametro = _diametro(agujeros)
+        if diametro is None:
+            diametro, por_defecto = (exterior - interior) / 8, por_defecto + 1
+        diametro_pernos = _valor(agujeros, r"circulo de pernos|bolt circle|pcd")
+        radio_pernos = diametro_pernos / 2 if diametro_pernos else (exterior + interior) / 4
+        params.update({"diametro_agujero": diametro, "radio_pernos": radio_pernos})
+        codigo += (
+            f"result = result.faces(\">Z\").workplane().polarArray({radio_pernos:g}, 0, 360, {n_agujeros})"
+            f".hole({diametro:g})\n"
+        )
+    return params, codigo, por_defecto
+
+
+def _plantilla_escuadra(cuerpo: str, agujeros: str, n_agujeros: int):
+    if n_agujeros:
+        return None
+    dims = _dimensiones(cuerpo)
+    espesor = _valor(cuerpo, "espesor|grosor|thickness|thick")
+    if not dims or len(dims) != 3:
+        return None
+    largo, ancho, alto = dims
+    por_defecto = 0
+    if espesor is None:
+        espesor, por_defecto = max(1.0, min(largo, alto) / 10), 1
+    params = {"largo": largo, "ancho": ancho, "alto": alto, "espesor": espesor}
+    codigo = (
+        "result = (cq.Workplane(\"XZ\")\n"
+        f"          .polyline([(0, 0), ({largo:g}, 0), ({largo:g}, {espesor:g}), "
+        f"({espesor:g}, {espesor:g}), ({espesor:g}, {alto:g}), (0, {alto:g})])\n"
+        f"          .close().extrude(-{ancho:g}))\n"
+    )
+    return params, codigo, por_defecto
+
+
+# Orden de preferencia: las formas más específicas primero
+PLANTILLAS = [
+    ("brida", r"\b(?:brida|flange)", _plantilla_brida),
+    ("escuadra", r"\b(?:escuadra|bracket|soporte en l|perfil en l|angulo en l)", _plantilla_escuadra),
+    ("placa", r"\b(?:placa|plancha|chapa|plate|plaque)", _plantilla_placa),
+    ("cilindro", r"\b(?:cilindro|cylinder|disco|disc|disk|barra redonda|rod)\b", _plantilla_cilindro),
+    ("caja", r"\b(?:cubo|caja|bloque|prisma|paralelepipedo|box|cube|block)\b", _plantilla_caja),
+]
+
+
+def extraer_plantilla(prompt: str):
+    """
+    Intenta mapear el prompt a una plantilla paramétrica.
+    Devuelve {'plantilla', 'params', 'confianza', 'codigo'} o None si no encaja ninguna.
+    El código devuelto aún no incluye la exportación (ver generar_codigo_plantilla).
+    """
+    if not prompt:
+        return None
+    texto = _normalizar(prompt)
+    formas = [p for p in PLANTILLAS if re.search(p[1], texto)]
+    if not formas:
+        return None
+    nombre, _, plantilla = formas[0]
+    cuerpo, agujeros = _partir_por_agujero(texto)
+    resultado = plantilla(cuerpo, agujeros, _n_agujeros(texto))
+    if resultado is None:
+        return None
+    params, codigo, por_defecto = resultado
+
+    # Cada parámetro supuesto, cada forma adicional mencionada, cada palabra que la plantilla no cubre
+    # y cada característica no soportada restan confianza
+    no_cubiertas = _palabras_no_cubiertas(texto)
+    confianza = 1.0 - 0.15 * por_defecto - 0.3 * (len(formas) - 1) - PENALIZACION_NO_CUBIERTA * len(no_cubiertas)
+    if any(re.search(rf"\b{c}", texto) for c in CARACTERISTICAS_NO_SOPORTADAS):
+        confianza *= 0.3
+    return {"plantilla": nombre, "params": params, "confianza": round(max(confianza, 0.0), 2), "codigo": codigo}
+
+
+def generar_codigo_plantilla(intencion: dict, nombre_pieza: str) -> str:
+    """Código CadQuery completo, con la exportación a parts/<nombre_pieza>/<nombre_pieza>.step."""
+    return (
+        CABECERA
+        + f"\n# Plantilla '{intencion['plantilla']}': {json.dumps(intencion['params'])}\n"
+        + intencion["codigo"]
+        + f"\ncq.exporters.export(result, 'parts/{nombre_pieza}/{nombre_pieza}.step')\n"
+    )
+
+
+def _cargar_estadisticas() -> dict:
+    return cargar_json(KB_PLANTILLAS_PATH, {"consultas": 0, "aciertos": 0, "por_plantilla": {}})
+
+
+def registrar_uso_plantilla(nombre_plantilla) -> None:
+    """Anota una consulta a la vía rápida; nombre_plantilla es None cuando se delega en el LLM."""
+    with _lock:
+        estadisticas = _cargar_estadisticas()
+        estadisticas["consultas"] += 1
+        if nombre_plantilla:
+            estadisticas["aciertos"] += 1
+            por_plantilla = estadisticas["por_plantilla"]
+            por_plantilla[nombre_plantilla] = por_plantilla.get(nombre_plantilla, 0) + 1
+        guardar_json(KB_PLANTILLAS_PATH, estadisticas)
+
+
+def resumen_estadisticas() -> str:
+    """Texto breve con la tasa de acierto de la vía rápida de plantillas."""
+    est = _cargar_estadisticas()
+    tasa = est["aciertos"] / est["consultas"] if est["consultas"] else 0.0
+    detalle = ", ".join(f"{k}: {v}" for k, v in sorted(est["por_plantilla"].items()))
+    return f"Plantillas: {est['aciertos']}/{est['consultas']} prompts sin LLM ({tasa:.0%}){' - ' + detalle if detalle else ''}"
+
+
+if __name__ == "__main__":
+    print(resumen_estadisticas())
@@ -1,10 +1,17 @@
-from openai import OpenAI
 import os
 import base64
+import re
+from src.utils.parts.modelos import completar
+
+def _questions_are_valid(questions):
+    # Baja confianza si no salen entre 2 y 5 preguntas terminadas en '?'
+    n_questions = sum(1 for line in (questions or "").splitlines() if line.strip().endswith("?"))
+    return 2 <= n_questions <= 5
+
 
 def generate_verification_questions(new_description):
     """
-    Llama a gpt-4o para generar entre 2 y 5 preguntas de verificación (sí/no) a partir de una descripción
+    Llama al modelo de la etapa 'questions' para generar entre 2 y 5 preguntas de verificación (sí/no) a partir de una descripción
     de diseño de un objeto 3D, usando ejemplos de referencia.
     
     Parámetros:
@@ -14,9 +21,6 @@ def generate_verification_questions(new_description):
     Retorna:
       - Un string con las preguntas generadas.
     """
-    # Inicializamos el cliente (asegúrate de tener OPENAI_API_KEY configurada)
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
     # Prompt del sistema (tal y como lo has definido)
     system_prompt = (
         "You will be given a description of how a human-designer would describe the design of a 3D object. "
@@ -62,21 +66,17 @@ def generate_verification_questions(new_description):
         {"role": "user", "content": "Now, given the following design description, please provide between 2 to 5 yes/no verification questions that adhere to the above guidelines:\n" + new_description}
     ]
     
-    # Llamamos al modelo gpt-4o
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages
-    )
+    # Modelo barato primero; se escala si las preguntas no cumplen el formato
+    questions, _ = completar("questions", messages, validar=_questions_are_valid)
     
     # Retornamos las preguntas generadas
-    return completion.choices[0].message.content
+    return questions
 def answer_verification_questions(image_paths, questions):
 
     """
-    Llama a gpt-4o para responder a un conjunto de preguntas de verificación, utilizando 4 imágenes
-    del objeto y un bloque de texto con las preguntas.
+    Llama al modelo de la etapa 'answers' para responder a un conjunto de preguntas de verificación,
+    utilizando 4 imágenes del objeto y un bloque de texto con las preguntas.
     """
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
     system_prompt = (
         "Your job is to answer this set of questions with respect to the object I have shared with you. \n"
@@ -124,17 +124,12 @@ def answer_verification_questions(image_paths, questions):
         {"role": "user", "content": user_content}
     ]
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        temperature=0.0
-    )
-
-    return response.choices[0].message.content
+    answers, _ = completar("answers", messages, validar=lambda a: bool(parse_verification_answers(a)), temperature=0.0)
+    return answers
 
 def generate_feedback(answers):
     """
-    Llama a gpt-4o para generar actionable feedback basado en las respuestas a las preguntas de verificación.
+    Llama al modelo de la etapa 'feedback' para generar actionable feedback basado en las respuestas a las preguntas de verificación.
     
     Parámetros:
       - answers: Texto que contiene las respuestas a las preguntas.
@@ -143,8 +138,6 @@ def generate_feedback(answers):
     Retorna:
       - Un string con el feedback accionable.
     """
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
     system_prompt = (
         "Your job is to generate actionable feedback to help correct mistakes in a 3D object. "
         "You will receive the answers to the verification questions, and your task is to summarize these answers into practical corrections that need to be made to the 3D object."
@@ -168,9 +161,23 @@ def generate_feedback(answers):
         {"role": "user", "content": user_input}
     ]
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages
-    )
+    feedback, _ = completar("feedback", messages, validar=lambda f: bool(f and f.strip()))
+    return feedback
+
+
+def parse_verification_answers(answers):
+    """
+    Extrae los veredictos del texto devuelto por answer_verification_questions.
     
-    return response.choices[0].message.content
\ No newline at end of file
+    Retorna:
+      - Lista de dicts {'question': str, 'answer': 'Yes' | 'No' | 'Unclear'}, en el orden original.
+    """
+    verdicts = []
+    blocks = re.split(r"^\s*\d+[.\-)]\s+", answers or "", flags=re.MULTILINE)
+    for block in blocks:
+        match = re.search(r"\*\*Answer:\*\*\s*\**\s*(Yes|No|Unclear)", block, re.IGNORECASE)
+        if not match:
+            continue
+        question = block.strip().splitlines()[0].strip().strip("*").strip()
+        verdicts.append({"question": question, "answer": match.group(1).capitalize()})
+    return verdicts
@@ -0,0 +1,79 @@
+import os
+import time
+import sqlite3
+
+import pytest
+
+pytest.importorskip("zstandard")
+
+from src.utils.parts import artefactos
+
+
+@pytest.fixture
+def almacen(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(artefactos, "OBJETOS_DIR", str(tmp_path / "artefactos" / "objetos"))
+    monkeypatch.setattr(artefactos, "MANIFIESTOS_DIR", str(tmp_path / "artefactos" / "manifiestos"))
+    return tmp_path
+
+
+def _envejecer(dias: float) -> None:
+    """Retrasa la fecha de todos los objetos y manifiestos del almacén."""
+    antes = time.time() - dias * 86400
+    for raiz, _, archivos in os.walk("artefactos"):
+        for nombre in archivos:
+            os.utime(os.path.join(raiz, nombre), (antes, antes))
+
+
+def _estado(run_id: str) -> str:
+    conn = sqlite3.connect(os.path.join(artefactos.MANIFIESTOS_DIR, f"{run_id}.sqlite"))
+    try:
+        return dict(conn.execute("SELECT clave, valor FROM run"))["estado"]
+    finally:
+        conn.close()
+
+
+def test_el_gc_conserva_las_ejecuciones_en_curso(almacen):
+    ref = artefactos.guardar_artefacto("codigo de una ejecución suspendida", "codigo", run_id="suspendida")
+    assert _estado("suspendida") == "en_curso"
+    _envejecer(30)
+
+    resultado = artefactos.gc(max_bytes=0, max_edad_dias=1, gracia_horas=0)
+
+    assert resultado["manifiestos_eliminados"] == []
+    assert resultado["objetos_eliminados"] == 0
+    assert artefactos.cargar_artefacto(ref) == "codigo de una ejecución suspendida"
+
+
+def test_el_gc_cierra_y_archiva_las_ejecuciones_abandonadas(almacen):
+    os.makedirs("parts/pieza")
+    for nombre in ("pieza.py", "pieza.step", "intento_anterior.step"):
+        with open(f"parts/pieza/{nombre}", "w") as f:
+            f.write(nombre)
+    artefactos.registrar_en_manifiesto("abandonada", [], {"nombre_pieza": "pieza"})
+    _envejecer(10)
+
+    resultado = artefactos.gc(abandono_dias=7)
+
+    assert resultado["ejecuciones_abandonadas"] == ["abandonada"]
+    assert _estado("abandonada") == "abandonada"
+    assert sorted(os.listdir("parts/pieza")) == ["pieza.py", "pieza.step"]
+    # Lo eliminado de parts/ queda en el almacén, referenciado por el manifiesto
+    conn = sqlite3.connect(os.path.join(artefactos.MANIFIESTOS_DIR, "abandonada.sqlite"))
+    digest, = conn.execute("SELECT sha256 FROM artefactos WHERE nombre = 'parts/pieza/intento_anterior.step'").fetchone()
+    conn.close()
+    with open(artefactos.restaurar_archivo(digest, "restaurado.step")) as f:
+        assert f.read() == "intento_anterior.step"
+
+
+def test_el_gc_elimina_las_ejecuciones_fallidas_antiguas(almacen):
+    ref = artefactos.guardar_artefacto("traceback", "error", run_id="fallida")
+    artefactos.cerrar_ejecucion("fallida", "fallida")
+    _envejecer(30)
+
+    resultado = artefactos.gc(max_edad_dias=1, gracia_horas=0)
+
+    assert resultado["manifiestos_eliminados"] == ["fallida"]
+    assert resultado["objetos_eliminados"] == 1
+    with pytest.raises(FileNotFoundError):
+        artefactos.cargar_artefacto(ref)
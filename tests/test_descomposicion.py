@@ -0,0 +1,54 @@
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+from src.utils.parts.descomposicion import generar_codigo_ensamblaje
+
+
+class _Solido:
+    """Sólido mínimo: caja envolvente y traslaciones acumuladas, lo que usa el script de ensamblaje."""
+
+    def __init__(self, centro):
+        self.centro = centro
+        self.operaciones = []
+
+    def val(self):
+        return self
+
+    def BoundingBox(self):
+        return types.SimpleNamespace(center=types.SimpleNamespace(x=self.centro[0], y=self.centro[1], z=self.centro[2]))
+
+    def translate(self, v):
+        return _Solido(tuple(c + d for c, d in zip(self.centro, v)))
+
+    def union(self, otro):
+        self.operaciones.append(("union", otro.centro))
+        return self
+
+    def cut(self, otro):
+        self.operaciones.append(("corte", otro.centro))
+        return self
+
+
+def test_el_ensamblaje_coloca_cada_subpieza_por_su_centro(tmp_path, monkeypatch):
+    # Cilindro de plantilla (z en [0, 20]) y escuadra construida desde una esquina
+    centros = {"p__0": (0.0, 0.0, 10.0), "p__1": (25.0, 15.0, 20.0)}
+    exportado = {}
+    cq = types.ModuleType("cadquery")
+    cq.importers = types.SimpleNamespace(importStep=lambda ruta: _Solido(centros[ruta.split("/")[1]]))
+    cq.exporters = types.SimpleNamespace(export=lambda r, ruta: exportado.update(resultado=r, ruta=ruta))
+    monkeypatch.setitem(sys.modules, "cadquery", cq)
+    monkeypatch.chdir(tmp_path)
+
+    codigo = generar_codigo_ensamblaje("p", [
+        {"indice": 0, "nombre": "cuerpo", "nombre_pieza": "p__0", "posicion": [0.0, 0.0, 0.0], "operacion": "union"},
+        {"indice": 1, "nombre": "ranura", "nombre_pieza": "p__1", "posicion": [5.0, 0.0, -2.0], "operacion": "corte"},
+    ])
+    exec(codigo, {})
+
+    assert exportado["ruta"] == "parts/p/p.step"
+    assert exportado["resultado"].centro == (0.0, 0.0, 0.0)
+    assert exportado["resultado"].operaciones == [("corte", (5.0, 0.0, -2.0))]
@@ -0,0 +1,32 @@
+import pytest
+
+from src.utils.parts import ejemplos
+from src.utils.parts.ejemplos import registrar_ejemplo, buscar_ejemplos, MARCADOR_NOMBRE_PIEZA
+
+CODIGO = (
+    "import os\nos.makedirs('parts', exist_ok=True)\nimport cadquery as cq\n"
+    "result = cq.Workplane('XY').box(10, 10, 10).faces('>Z').workplane().hole(4)\n"
+    "cq.exporters.export(result, 'parts/cubo/cubo.step')\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def indice_vacio(tmp_path, monkeypatch):
+    monkeypatch.setattr(ejemplos, "KB_EJEMPLOS_PATH", str(tmp_path / "ejemplos.json"))
+
+
+def test_con_un_solo_documento_se_recupera_el_casi_duplicado():
+    registrar_ejemplo("Genera un cubo de 10x10x10 con un agujero de radio 2 en el centro", CODIGO, [], "cubo")
+
+    encontrados = buscar_ejemplos("Genera un cubo de 20x20x20 con un agujero de radio 3 en el centro")
+
+    assert len(encontrados) == 1
+    assert encontrados[0]["similitud"] > 0.5
+    assert f"'{MARCADOR_NOMBRE_PIEZA}.step'" in encontrados[0]["codigo"]
+    assert "parts/cubo" not in encontrados[0]["codigo"]
+
+
+def test_un_prompt_sin_terminos_comunes_no_recupera_nada():
+    registrar_ejemplo("Genera un cubo con un agujero en el centro", CODIGO, [], "cubo")
+
+    assert buscar_ejemplos("Engranaje helicoidal") == []
@@ -0,0 +1,109 @@
+import pytest
+
+from src.utils.parts import errores
+from src.utils.parts.errores import normalizar_error, buscar_reparacion_local, _calcular_parche, _aplicar_parche
+
+
+def _traceback(linea_script: str, ultima: str, operacion: str = "close") -> str:
+    return (
+        "Traceback (most recent call last):\n"
+        '  File "/tmp/tmpa1b2/llm_code.py", line 7, in <module>\n'
+        f"    {linea_script}\n"
+        f'  File "/opt/conda/lib/python3.11/site-packages/cadquery/cq.py", line 1201, in {operacion}\n'
+        "    raise ValueError\n"
+        f"{ultima}\n"
+    )
+
+
+@pytest.fixture(autouse=True)
+def kb_vacia(tmp_path, monkeypatch):
+    monkeypatch.setattr(errores, "KB_ERRORES_PATH", str(tmp_path / "errores.json"))
+
+
+def test_la_firma_ignora_numeros_rutas_y_cadenas():
+    a = normalizar_error(_traceback("r = cq.Workplane().box(10, 20, 5).faces('>Z').fillet(3)",
+                                    "OCP.StdFail.StdFail_NotDone: BRep_API: command not done at 0x7f12ab", "fillet"))
+    b = normalizar_error(_traceback("r = cq.Workplane().box(4, 4, 4).faces('<X').fillet(1.5)",
+                                    "OCP.StdFail.StdFail_NotDone: BRep_API: command not done at 0x55aa01", "fillet"))
+    assert a["firma"] == b["firma"]
+    assert a["tipo"] == "StdFail_NotDone"
+    assert a["operacion"] == "fillet"
+
+
+def test_la_operacion_sale_del_script_sin_frames_de_cadquery():
+    error = normalizar_error('Traceback (most recent call last):\n'
+                             '  File "llm_code.py", line 4, in <module>\n'
+                             '    r = base.edges("|Z").fillet(2)\n'
+                             'ValueError: Fillets requires that edges be selected')
+    assert error["tipo"] == "ValueError"
+    assert error["operacion"] == "fillet"
+
+
+def test_regla_fillet_reducido():
+    codigo = "r = cq.Workplane().box(10, 10, 10).edges('|Z').fillet(4)\n"
+    nuevo, origen = buscar_reparacion_local(codigo, "StdFail_NotDone: BRep_API: command not done")
+    assert origen == "regla:fillet_reducido"
+    assert ".fillet(2)" in nuevo
+
+
+def test_regla_export_invertido():
+    codigo = "cq.exporters.export('parts/p/p.step', result)\n"
+    nuevo, origen = buscar_reparacion_local(codigo, "AttributeError: 'str' object has no attribute 'val' in export")
+    assert origen == "regla:export_invertido"
+    assert "cq.exporters.export(result, 'parts/p/p.step')" in nuevo
+
+
+def test_regla_step_no_encontrado_anade_la_exportacion():
+    codigo = "import cadquery as cq\npieza = cq.Workplane().box(1, 1, 1)\n"
+    nuevo, origen = buscar_reparacion_local(codigo, "Error: Archivo STEP no encontrado en parts/p/p.step")
+    assert origen == "regla:step_no_encontrado"
+    assert nuevo.endswith("cq.exporters.export(pieza, 'parts/p/p.step')\n")
+
+
+def test_una_seleccion_vacia_se_delega_en_el_llm():
+    # Quitar el redondeo pedido no es una reparación: no hay regla local
+    codigo = "r = cq.Workplane().box(10, 10, 10).edges('>Z and <X').fillet(1)\n"
+    mensaje = _traceback("r = cq.Workplane().box(10, 10, 10).edges('>Z and <X').fillet(1)",
+                         "ValueError: Fillets requires that edges be selected", "fillet")
+    assert buscar_reparacion_local(codigo, mensaje) == (None, None)
+
+
+FALLIDO = (
+    "import cadquery as cq\n"
+    "perfil = cq.Workplane('XZ').polyline([(0, 0), (30, 0), (30, 5)])\n"
+    "result = perfil.extrude(-20)\n"
+)
+REPARADO = (
+    "import cadquery as cq\n"
+    "perfil = cq.Workplane('XZ').polyline([(0, 0), (30, 0), (30, 5)]).close()\n"
+    "result = perfil.extrude(-20)\n"
+)
+
+
+def test_un_parche_aprendido_se_aplica_con_otras_medidas_y_nombres():
+    parche = _calcular_parche(FALLIDO, REPARADO)
+    otro = (
+        "import cadquery as cq\n"
+        "base = cq.Workplane('XZ').polyline([(0, 0), (50, 0), (50, 8)])\n"
+        "pieza = base.extrude(-35)\n"
+    )
+    nuevo = _aplicar_parche(otro, parche)
+    assert "base = cq.Workplane('XZ').polyline([(0, 0), (50, 0), (50, 8)]).close()" in nuevo
+    assert "pieza = base.extrude(-35)" in nuevo
+
+
+def test_un_parche_no_se_aplica_a_otra_estructura():
+    parche = _calcular_parche(FALLIDO, REPARADO)
+    # Otro plano de trabajo (las cadenas se comparan literalmente) y otra operación
+    assert _aplicar_parche(FALLIDO.replace("'XZ'", "'XY'"), parche) is None
+    assert _aplicar_parche(FALLIDO.replace(".polyline(", ".spline("), parche) is None
+
+
+def test_las_reparaciones_aprendidas_se_reutilizan_entre_piezas():
+    mensaje = _traceback("result = perfil.extrude(-20)", "ValueError: No pending wires present")
+    errores.registrar_resultado_reparacion({"error": mensaje, "codigo_fallido": FALLIDO, "origen": "llm"}, REPARADO, True)
+
+    otro = FALLIDO.replace("30", "45").replace("perfil", "seccion")
+    nuevo, origen = buscar_reparacion_local(otro, mensaje.replace("perfil", "seccion").replace("-20", "-12"))
+    assert origen.startswith("kb:")
+    assert "(45, 5)]).close()" in nuevo
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("zstandard")
+
+from src.nodes import feedback
+from src.utils.parts import artefactos, ejemplos
+from src.utils.parts.descomposicion import generar_codigo_ensamblaje
+
+RESPUESTAS = "1. **Is it a plate?**\n   - **Answer:** Yes\n2. **Has it a shaft?**\n   - **Answer:** Yes\n"
+CODIGO_EJE = "import cadquery as cq\nresult = cq.Workplane('XY').polygon(6, 8).extrude(20)\ncq.exporters.export(result, 'parts/p__1/p__1.step')\n"
+
+
+@pytest.fixture(autouse=True)
+def almacenes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(artefactos, "OBJETOS_DIR", str(tmp_path / "objetos"))
+    monkeypatch.setattr(artefactos, "MANIFIESTOS_DIR", str(tmp_path / "manifiestos"))
+    monkeypatch.setattr(ejemplos, "KB_EJEMPLOS_PATH", str(tmp_path / "ejemplos.json"))
+
+
+def test_una_pieza_ensamblada_indexa_sus_subpiezas_y_no_el_ensamblaje():
+    subpiezas = [
+        {"indice": 0, "nombre": "base", "descripcion": "Una placa de 40x40x5 mm", "nombre_pieza": "p__0",
+         "posicion": [0.0, 0.0, 0.0], "operacion": "union", "ok": True, "origen": "plantilla:placa"},
+        {"indice": 1, "nombre": "eje", "descripcion": "Un eje hexagonal de 8 mm y 20 mm de largo", "nombre_pieza": "p__1",
+         "posicion": [0.0, 0.0, 12.5], "operacion": "union", "ok": True, "origen": "llm:gpt-4o"},
+    ]
+    os.makedirs("parts/p__1")
+    with open("parts/p__1/p__1.py", "w", encoding="utf-8") as f:
+        f.write(CODIGO_EJE)
+    state = {
+        'nombre_pieza': "p",
+        'prompt_entrada': "Placa de 40x40x5 con un eje hexagonal",
+        'plan_subpiezas': subpiezas,
+        'subpiezas': subpiezas,
+        'codigo_extraido': artefactos.guardar_artefacto(generar_codigo_ensamblaje("p", subpiezas), "codigo"),
+        'respuestas_ia_verificacion': artefactos.guardar_artefacto(RESPUESTAS, "respuestas"),
+    }
+
+    assert feedback.feedback_node(state)['resultado_feedback'] == "ok"
+
+    documentos = ejemplos._cargar_indice()["documentos"]
+    assert [d["prompt"] for d in documentos] == ["Un eje hexagonal de 8 mm y 20 mm de largo"]
+    assert "importStep" not in documentos[0]["codigo"]
+    assert f"'{ejemplos.MARCADOR_NOMBRE_PIEZA}.step'" in documentos[0]["codigo"]
@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("zstandard")
+
+from src.nodes import feedforward
+from src.utils.parts import artefactos
+
+
+def test_el_nivel_sale_del_contador_y_no_del_historial(tmp_path, monkeypatch):
+    monkeypatch.setattr(artefactos, "OBJETOS_DIR", str(tmp_path / "objetos"))
+    monkeypatch.setattr(artefactos, "MANIFIESTOS_DIR", str(tmp_path / "manifiestos"))
+    niveles = []
+
+    def refine(prompt, codigo, contexto, nombre_pieza, nivel):
+        niveles.append(nivel)
+        return "```python\nresult = 1\n```", "gpt-4o"
+    monkeypatch.setattr(feedforward, "refine_cadquery_code", refine)
+
+    # El anillo del historial ya ha perdido las regeneraciones anteriores
+    state = {
+        'nombre_pieza': "pieza",
+        'prompt_entrada': "Una pieza",
+        'codigo_extraido': artefactos.guardar_artefacto("result = 0", "codigo"),
+        'historial': [{'etapa': "ejecutar_codigo", 'resultado': "ok", 'n': 20}],
+        'feedforward_intentos': 3,
+    }
+    out = feedforward.feedforward_node(state)
+
+    assert niveles == [3]
+    assert out['feedforward_intentos'] == 4
@@ -0,0 +1,21 @@
+import os
+import threading
+
+from src.utils.parts.kb import cargar_json, guardar_json
+
+
+def test_cargar_json_devuelve_el_valor_por_defecto_si_no_existe(tmp_path):
+    assert cargar_json(str(tmp_path / "no_existe.json"), {"vacio": True}) == {"vacio": True}
+
+
+def test_escrituras_concurrentes_no_comparten_temporal(tmp_path):
+    ruta = str(tmp_path / "kb" / "datos.json")
+    hilos = [threading.Thread(target=guardar_json, args=(ruta, {"hilo": i, "datos": list(range(1000))}))
+             for i in range(8)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    assert cargar_json(ruta, None)["datos"] == list(range(1000))
+    assert os.listdir(tmp_path / "kb") == ["datos.json"]
@@ -0,0 +1,236 @@
+import os
+import json
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("zstandard")
+
+from typing_extensions import TypedDict
+from langgraph.graph import StateGraph, START, END
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.types import Command
+from langgraph.errors import GraphInterrupt
+
+from src.utils.parts import lotes
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "lotes.json")
+
+
+@pytest.fixture
+def dir_lotes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    d = tmp_path / "lotes"
+    for nombre, ruta in [("LOTES_DIR", d), ("PENDIENTES_PATH", d / "pendientes.jsonl"),
+                         ("RESULTADOS_PATH", d / "resultados.jsonl"), ("ENVIOS_PATH", d / "envios.json"),
+                         ("HILOS_PATH", d / "hilos.json"), ("CONTADOS_PATH", d / "contados.json"),
+                         ("ENVIADOS_DIR", d / "enviados"),
+                         ("SALIDAS_DIR", d / "salidas")]:
+        monkeypatch.setattr(lotes, nombre, str(ruta))
+    monkeypatch.setattr(lotes, "_resultados", {"mtime": None, "por_id": {}})
+    return d
+
+
+class _Estado(TypedDict, total=False):
+    nombre_pieza: str
+    prompt_entrada: str
+    run_id: str
+    preguntas: str
+    codigo: str
+
+
+def _grafo():
+    """Dos llamadas al LLM seguidas, como 'questions' y 'generar_pieza': dos rondas de lote."""
+    def preguntas(state):
+        messages = [{"role": "system", "content": "Answer each question with Yes or No."},
+                    {"role": "user", "content": state["prompt_entrada"]}]
+        return {"preguntas": lotes.completar_en_lote("questions", "gpt-4o-mini", messages, {"temperature": 0.0})}
+
+    def codigo(state):
+        messages = [{"role": "user", "content": f"Genera el código CadQuery: {state['prompt_entrada']}"}]
+        return {"codigo": lotes.completar_en_lote("generar", "gpt-4o-mini", messages, {"temperature": 0.0})}
+
+    builder = StateGraph(_Estado)
+    builder.add_node("preguntas", preguntas)
+    builder.add_node("codigo", codigo)
+    builder.add_edge(START, "preguntas")
+    builder.add_edge("preguntas", "codigo")
+    builder.add_edge("codigo", END)
+    return builder.compile(checkpointer=InMemorySaver())
+
+
+def _ronda(graph, hilos):
+    resultado = lotes.simular(FIXTURES)
+    lotes.reanudar(graph, hilos)
+    return resultado
+
+
+def test_barrido_se_suspende_y_se_reanuda_con_los_resultados_simulados(dir_lotes):
+    graph = _grafo()
+    hilos = {}
+    barrido_id = lotes.barrido(graph, [{"nombre_pieza": "placa", "prompt_entrada": "Una placa de 40x40x5 mm"}], hilos)
+    hilo = f"{barrido_id}:placa"
+    assert hilos[hilo] == {"nombre_pieza": "placa", "barrido": barrido_id, "estado": "suspendido"}
+    assert len(lotes._leer_jsonl(lotes.PENDIENTES_PATH)) == 1
+
+    assert _ronda(graph, hilos) == {"ok": 1, "errores": 0, "reintentables": 0}
+    assert hilos[hilo]["estado"] == "suspendido"
+    assert _ronda(graph, hilos) == {"ok": 1, "errores": 0, "reintentables": 0}
+    assert hilos[hilo]["estado"] == "terminado"
+
+    valores = graph.get_state({"configurable": {"thread_id": hilo}}).values
+    assert valores["preguntas"].startswith("1. Is it a plate?")
+    assert "box(40, 40, 5)" in valores["codigo"]
+    assert valores["run_id"] == f"placa-{barrido_id}"
+    assert os.listdir(lotes.ENVIADOS_DIR) and all(n.endswith(".simulado") for n in os.listdir(lotes.ENVIADOS_DIR))
+
+    # Un hilo terminado no se vuelve a lanzar ni a reanudar
+    assert lotes._avanzar(graph, hilo, Command(resume=True)) == "terminado"
+    assert lotes._avanzar(graph, hilo, {"nombre_pieza": "placa", "prompt_entrada": "otra"}) == "terminado"
+    assert graph.get_state({"configurable": {"thread_id": hilo}}).values["codigo"] == valores["codigo"]
+
+    # El barrido siguiente usa hilos nuevos y responde desde los resultados ya ingeridos
+    otro_id = lotes.barrido(graph, [{"nombre_pieza": "placa", "prompt_entrada": "Una placa de 40x40x5 mm"}], hilos)
+    assert otro_id != barrido_id
+    assert hilos[f"{otro_id}:placa"]["estado"] == "terminado"
+    assert not lotes._leer_jsonl(lotes.PENDIENTES_PATH)
+
+
+def test_en_modo_lote_completar_no_exige_clave_de_openai(monkeypatch):
+    pytest.importorskip("openai")
+    from src.utils.parts import modelos
+    monkeypatch.setenv("CQ_MODO_LOTE", "1")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(modelos, "completar_en_lote", lambda etapa, modelo, messages, kwargs: "hola")
+    monkeypatch.setattr(modelos, "_actualizar_estadisticas", lambda *a, **k: None)
+
+    assert modelos.completar("questions", [{"role": "user", "content": "Una placa"}])[0] == "hola"
+
+    monkeypatch.delenv("CQ_MODO_LOTE")
+    with pytest.raises(ValueError, match="OPENAI_API_KEY"):
+        modelos.completar("questions", [{"role": "user", "content": "Una placa"}])
+
+
+def test_un_nodo_reanudado_no_cuenta_dos_veces_sus_llamadas(dir_lotes, tmp_path, monkeypatch):
+    pytest.importorskip("openai")
+    from src.utils.parts import modelos, errores, codigo
+    monkeypatch.setenv("CQ_MODO_LOTE", "1")
+    monkeypatch.setattr(modelos, "KB_RUTAS_PATH", str(tmp_path / "rutas.json"))
+    monkeypatch.setattr(errores, "KB_ERRORES_PATH", str(tmp_path / "errores.json"))
+
+    def preguntas(state):
+        # Dos llamadas en el mismo nodo: al reanudar la segunda, la primera se repite desde los resultados
+        primera, _ = modelos.completar("questions", [{"role": "user", "content": "Answer with Yes or No: ¿placa?"}])
+        segunda, _ = modelos.completar("questions", [{"role": "user", "content": "Answer with Yes or No: ¿agujeros?"}])
+        return {"preguntas": primera + segunda}
+
+    builder = StateGraph(_Estado)
+    builder.add_node("preguntas", preguntas)
+    builder.add_edge(START, "preguntas")
+    builder.add_edge("preguntas", END)
+    graph = builder.compile(checkpointer=InMemorySaver())
+    hilos = {}
+    barrido_id = lotes.barrido(graph, [{"nombre_pieza": "placa", "prompt_entrada": "Una placa"}], hilos)
+    _ronda(graph, hilos)
+    _ronda(graph, hilos)
+    assert hilos[f"{barrido_id}:placa"]["estado"] == "terminado"
+
+    # Sin latencias (serían las de leer el resultado guardado) y cada respuesta una sola vez
+    assert modelos._cargar_estadisticas()["questions"]["gpt-4o-mini"] == {
+        "llamadas": 0, "exitos": 2, "fallos": 0, "latencia_total": 0.0}
+
+    # La consulta al LLM de una reparación se anota al volver, no antes de suspender el grafo
+    def suspender(codigo_fallido, mensaje_error, nivel=0):
+        raise GraphInterrupt()
+    monkeypatch.setattr(codigo, "repair_cadquery_code", suspender)
+    with pytest.raises(GraphInterrupt):
+        codigo.reparar_codigo("result = 1\n", "ValueError: algo raro")
+    assert errores._cargar_kb()["estadisticas"]["consultas_llm"] == 0
+
+
+def test_barrido_simulado_del_grafo_real_sin_clave_de_openai(dir_lotes, monkeypatch):
+    # El grafo completo ejecuta el código CadQuery y renderiza el .step: necesita el entorno CAD
+    pytest.importorskip("cadquery")
+    pytest.importorskip("OCC")
+    from src.graph.grafo import builder
+    from src.nodes import fotografo
+
+    def imagenes(step_path, output_dir):
+        ruta = os.path.join(output_dir, "vista_1.png")
+        with open(ruta, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+        return [ruta]
+
+    monkeypatch.setattr(fotografo, "generate_cad_images_from_step", imagenes)
+    monkeypatch.setenv("CQ_MODO_LOTE", "1")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    graph = builder.compile(checkpointer=InMemorySaver())
+    hilos = {}
+    # Sin plantilla para engranajes: la pieza pasa por generar_pieza
+    barrido_id = lotes.barrido(graph, [{"nombre_pieza": "engranaje",
+                                        "prompt_entrada": "Un engranaje recto de 20 dientes y 40 mm de diametro"}], hilos)
+    hilo = f"{barrido_id}:engranaje"
+    for _ in range(10):
+        if hilos[hilo]["estado"] != "suspendido":
+            break
+        _ronda(graph, hilos)
+
+    assert hilos[hilo]["estado"] == "terminado"
+    valores = graph.get_state({"configurable": {"thread_id": hilo}}).values
+    assert valores["resultado_feedback"] == "ok"
+    assert "generar_pieza" in [paso["etapa"] for paso in valores["historial"]]
+    assert os.path.exists("parts/engranaje/engranaje.step")
+
+
+def _linea_ok(custom_id, contenido):
+    return {"id": f"batch_req_{custom_id}", "custom_id": custom_id,
+            "response": {"status_code": 200, "request_id": f"req_{custom_id}",
+                         "body": {"id": "chatcmpl-1", "object": "chat.completion", "model": "gpt-4o-mini-2024-07-18",
+                                  "choices": [{"index": 0, "message": {"role": "assistant", "content": contenido},
+                                               "finish_reason": "stop"}],
+                                  "usage": {"prompt_tokens": 20, "completion_tokens": 5, "total_tokens": 25}}},
+            "error": None}
+
+
+def _linea_error_http(custom_id, status_code, tipo, code):
+    return {"id": f"batch_req_{custom_id}", "custom_id": custom_id,
+            "response": {"status_code": status_code, "request_id": f"req_{custom_id}",
+                         "body": {"error": {"message": "Error de la API", "type": tipo, "param": None, "code": code}}},
+            "error": None}
+
+
+def _escribir(ruta, lineas):
+    with open(ruta, "w", encoding="utf-8") as f:
+        for linea in lineas:
+            f.write(json.dumps(linea) + "\n")
+    return str(ruta)
+
+
+def test_ingerir_guarda_respuestas_y_errores_definitivos(dir_lotes, tmp_path):
+    salida = _escribir(tmp_path / "salida.jsonl", [
+        _linea_ok("ok", "hola"),
+        _linea_error_http("invalido", 400, "invalid_request_error", "invalid_value"),
+        _linea_error_http("servidor", 500, "server_error", None),
+        _linea_error_http("limite", 429, "requests", "rate_limit_exceeded"),
+    ])
+    errores = _escribir(tmp_path / "errores.jsonl", [
+        {"id": "batch_req_caducada", "custom_id": "caducada", "response": None,
+         "error": {"code": "batch_expired", "message": "This request could not be executed before the completion window expired."}},
+    ])
+
+    assert lotes.ingerir(salida) == {"ok": 1, "errores": 1, "reintentables": 2}
+    assert lotes.ingerir(errores) == {"ok": 0, "errores": 0, "reintentables": 1}
+
+    assert lotes._buscar_resultado("ok") == {"custom_id": "ok", "contenido": "hola", "error": None}
+    assert json.loads(lotes._buscar_resultado("invalido")["error"])["code"] == "invalid_value"
+    # Los errores transitorios no quedan como resultado: la petición se vuelve a encolar
+    for custom_id in ("servidor", "limite", "caducada"):
+        assert lotes._buscar_resultado(custom_id) is None
+
+
+def test_una_respuesta_correcta_prevalece_sobre_un_error(dir_lotes, tmp_path):
+    lotes.ingerir(_escribir(tmp_path / "1.jsonl", [_linea_error_http("p", 400, "invalid_request_error", None)]))
+    lotes.ingerir(_escribir(tmp_path / "2.jsonl", [_linea_ok("p", "bien")]))
+    lotes.ingerir(_escribir(tmp_path / "3.jsonl", [_linea_error_http("p", 400, "invalid_request_error", None)]))
+
+    assert lotes._buscar_resultado("p")["contenido"] == "bien"
@@ -0,0 +1,55 @@
+import pytest
+
+from src.utils.parts.plantillas import extraer_plantilla, generar_codigo_plantilla, _n_agujeros, CONFIANZA_MINIMA
+
+
+@pytest.mark.parametrize("prompt, plantilla", [
+    ("Genera un cubo de 10x10x10 con un agujero cilíndrico de radio 2 en el centro.", "caja"),
+    ("Una placa de 100x50x5 mm con 4 agujeros de diámetro 6 en las esquinas", "placa"),
+    ("Cilindro de radio 10 y altura 40 con un agujero pasante de diámetro 5", "cilindro"),
+    ("Brida con diámetro exterior de 80, diámetro interior de 40 y 6 agujeros de diámetro 8", "brida"),
+    ("Una escuadra de 50x30x40 con espesor 5", "escuadra"),
+    ("A 40x40x10 plate with 4 holes of diameter 5 at the corners", "placa"),
+])
+def test_piezas_primitivas_usan_la_plantilla(prompt, plantilla):
+    intencion = extraer_plantilla(prompt)
+    assert intencion["plantilla"] == plantilla
+    assert intencion["confianza"] >= CONFIANZA_MINIMA
+
+
+@pytest.mark.parametrize("prompt", [
+    # Dos agujeros distintos: la plantilla de caja solo sabe hacer uno
+    "Cubo de 20x20x20 con agujero de radio 2 y otro agujero de radio 4",
+    # Características que ninguna plantilla construye y que no son palabras clave conocidas
+    "Un cubo de 30x30x30 vaciado con paredes de 2 mm",
+    "Una caja de 20x30x40 con tapa",
+    # Característica no soportada explícita
+    "Una placa de 40x40x5 con las esquinas redondeadas",
+    # Las plantillas trabajan en mm: otras unidades no se convierten
+    "Una caja de 2x3x4 cm",
+    # Agujero más grande que la cara en la que se taladra
+    "Un cubo de 10x10x10 con un agujero de radio 20",
+    # Un solo agujero fuera del centro
+    "Una placa de 40x40x5 con un agujero de 10 mm de diametro en una esquina",
+])
+def test_descripciones_no_cubiertas_se_delegan_en_el_llm(prompt):
+    intencion = extraer_plantilla(prompt)
+    assert intencion is None or intencion["confianza"] < CONFIANZA_MINIMA
+
+
+@pytest.mark.parametrize("texto, n", [
+    ("placa con 4 agujeros de diametro 6", 4),
+    ("cubo con agujero de radio 2 y otro agujero de radio 4", 2),
+    ("brida con dos taladros y otros 2 taladros", 4),
+    ("a plate with one hole", 1),
+    ("una caja de 20x30x40", 0),
+])
+def test_n_agujeros_cuenta_todas_las_menciones(texto, n):
+    assert _n_agujeros(texto) == n
+
+
+def test_codigo_de_plantilla_exporta_a_parts():
+    intencion = extraer_plantilla("Una caja de 20x30x40")
+    codigo = generar_codigo_plantilla(intencion, "caja_prueba")
+    assert "box(20, 30, 40)" in codigo
+    assert codigo.rstrip().endswith("cq.exporters.export(result, 'parts/caja_prueba/caja_prueba.step')")